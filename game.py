@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 
-import optparse
+import optparse, multiprocessing, itertools, time, json
 from lib.settings import settings
 
 p = optparse.OptionParser()
@@ -8,15 +8,28 @@ p.add_option("-p", "--profile", action = "store_true", dest = "profile", help =
 p.add_option("--tests", dest = "tests", help = "Execute specified tests and exit")
 p.add_option("--all-tests", action = "store_true", dest = "all_tests", help = "Execute all tests and exit")
 p.add_option("--test-repeat", dest = "test_repeat", type = "int", help = "Repeat each test N times and exit", metavar = "N")
+p.add_option("--benchmarks", dest = "benchmarks", help = "Run specified benchmarks and exit")
+p.add_option("--all-benchmarks", action = "store_true", dest = "all_benchmarks", help = "Run all benchmarks and exit")
+p.add_option("--benchmark-output", dest = "benchmark_output", help = "Write benchmark results as JSON to FILE", metavar = "FILE")
+p.add_option("-j", "--jobs", dest = "jobs", type = "int", help = "Run tests in N parallel processes", metavar = "N")
+p.add_option("--seed", dest = "seed", type = "int", help = "Seed the world random number generator", metavar = "N")
 p.add_option("--screen", dest = "screen_size", help = "Screen size WIDTHxHEIGHT", metavar = "WxH")
 p.add_option("--fullscreen", dest = "fullscreen", action = "store_true", help = "Start in fullscreen")
 p.add_option("--no-fullscreen", dest = "no_fullscreen", action = "store_true", help = "Start windowed")
-p.set_defaults(profile = False, all_tests = False, test_repeat = 5)
+p.add_option("--dirty-rects", dest = "dirty_rects", action = "store_true", help = "Software rendering, only redrawing what changed")
+p.add_option("--control-budget", dest = "control_budget", type = "float", help = "Spend at most MS milliseconds on planners per tick, 0 for no limit", metavar = "MS")
+p.set_defaults(profile = False, all_tests = False, all_benchmarks = False, test_repeat = 5, jobs = 1)
 (options, args) = p.parse_args()
 
 # set settings
-if options.all_tests or options.tests:
-  settings.set(fullscreen = False, screen_width = 800, screen_height = 400, game_speed = 500.0, target_fps = 5.0, debug = True, graphics_provider = "none")
+testing = options.all_tests or options.tests
+benchmarking = options.all_benchmarks or options.benchmarks
+if testing or benchmarking:
+  # a time budget would make the planners depend on the machine
+  settings.set(fullscreen = False, screen_width = 800, screen_height = 400, debug = True, graphics_provider = "none", headless = True,
+               control_budget = None)
+if options.seed is not None:
+  settings.set(seed = options.seed)
 if options.screen_size:
   w, h = options.screen_size.split("x")
   settings.set(screen_width = int(w), screen_height = int(h))
@@ -24,6 +37,10 @@ if options.fullscreen:
   settings.set(fullscreen = True)
 if options.no_fullscreen:
   settings.set(fullscreen = False)
+if options.dirty_rects:
+  settings.set(graphics_provider = "pygame", dirty_rects = True)
+if options.control_budget is not None:
+  settings.set(control_budget = options.control_budget or None)
 settings.dump()
 print options
 
@@ -36,7 +53,28 @@ pygame.key.set_repeat(300, 150)
 from lib import debug, graphics, resources, menu
 resources.Resources(graphics.default_provider())
 
-def run_tests(testspec, iterations):
+def init_worker():
+    # forked workers inherit the resources, others need a headless provider
+    if resources.Resources.graphics is None:
+      pygame.init()
+      resources.Resources(graphics.nographics_provider())
+
+def run_test(task):
+    path, i, iterations = task
+    Story = storybook.get(path)
+    debug.dbg("Running %u/%u iterations of %s" % (i + 1, iterations, Story.__name__))
+    # repeated runs differ from each other, but are reproducible with --seed
+    if settings.seed is None:
+      seed = None
+    else:
+      seed = settings.seed + i
+    start = time.time()
+    w = World(Story, seed)
+    return { "story": Story.__name__, "iteration": i, "result": w.story.game_result,
+             "game_time": w.get_time(), "duration": time.time() - start,
+             "info": w.story.debug_info() }
+
+def run_tests(testspec, iterations, jobs = 1):
     if testspec is None:
       # run all
       tests = storybook.get_set("tests")
@@ -45,21 +83,105 @@ def run_tests(testspec, iterations):
       tests = []
       for test in testspec.split(","):
         tests.append(storybook.get(test))
+    tasks = []
     for Story in tests:
+      path = "%s.%s" % (Story.storybook_path, Story.__name__)
       for i in xrange(iterations):
-        debug.dbg("Running %u/%u iterations of %s" % (i + 1, iterations, Story.__name__))
-        w = World(Story)
-        debug.dbg("Finished: %s" % (w.story.debug_info()))
+        tasks.append((path, i, iterations))
+
+    if jobs > 1:
+      pool = multiprocessing.Pool(jobs, init_worker)
+      runs = pool.imap_unordered(run_test, tasks)
+    else:
+      pool = None
+      runs = itertools.imap(run_test, tasks)
+    results = []
+    for run in runs:
+      debug.dbg("Finished: %s" % (run["info"]))
+      results.append(run)
+    if pool is not None:
+      pool.close()
+      pool.join()
+    test_report(results)
+
+def test_report(results):
+    stories = {}
+    for run in results:
+      stories.setdefault(run["story"], []).append(run)
+    print "%-15s %7s %10s %10s" % ("test", "won", "game time", "duration")
+    for name in sorted(stories.keys()):
+      runs  = stories[name]
+      count = len(runs)
+      won   = len([run for run in runs if run["result"]])
+      print "%-15s %3u/%-3u %9.1fs %9.2fs" % (name, won, count,
+            sum([run["game_time"] for run in runs]) / count,
+            sum([run["duration"] for run in runs]) / count)
+
+def peak_memory():
+    """ peak resident memory of this process in kB, None if unknown """
+    try:
+      import resource
+    except ImportError:
+      return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def run_benchmark(path):
+    Story = storybook.get(path)
+    debug.dbg("Running benchmark %s" % (Story.__name__))
+    # same simulation on every run unless asked otherwise
+    if settings.seed is None:
+      seed = 0
+    else:
+      seed = settings.seed
+    start = time.time()
+    w = World(Story, seed)
+    duration = time.time() - start
+    ticks = w.timers.update.count
+    phases = {}
+    for key, timer in w.timers.items.items():
+      if timer.count:
+        phases[key] = { "mean_ms": timer.mean(), "total_ms": timer.total, "count": timer.count }
+    return { "benchmark": Story.__name__, "seed": seed,
+             "game_time": w.get_time(), "duration": duration,
+             "ticks": ticks, "ticks_per_sec": ticks / duration,
+             "actors": len(w.all_actors()), "phases": phases,
+             "control_latency": w.counters.control_latency.mean(),
+             "peak_memory_kb": peak_memory() }
+
+def run_benchmarks(spec, jobs = 1, output = None):
+    if spec is None:
+      benchmarks = storybook.get_set("benchmarks")
+      benchmarks.sort(key = lambda Story: Story.__name__)
+    else:
+      benchmarks = [storybook.get(name) for name in spec.split(",")]
+    paths = ["%s.%s" % (Story.storybook_path, Story.__name__) for Story in benchmarks]
+
+    # fresh process for each, so that peak memory is per benchmark
+    pool = multiprocessing.Pool(jobs, init_worker, maxtasksperchild = 1)
+    results = pool.map(run_benchmark, paths)
+    pool.close()
+    pool.join()
+
+    report = json.dumps(results, indent = 2, sort_keys = True)
+    if output:
+      f = open(output, "w")
+      f.write(report + "\n")
+      f.close()
+    else:
+      print report
 
 # testing
-if options.all_tests or options.tests:
+if testing or benchmarking:
   from lib.stories import testlevels, storybook
   from lib.world import World
+if benchmarking:
+  run_benchmarks(options.benchmarks, options.jobs, options.benchmark_output)
+elif testing:
   if options.profile:
     import cProfile
-    cProfile.run("run_tests(options.tests, options.test_repeat)", "game.stats")
+    cProfile.run("run_tests(options.tests, options.test_repeat, options.jobs)", "game.stats")
   else:
-    run_tests(options.tests, options.test_repeat)
+    run_tests(options.tests, options.test_repeat, options.jobs)
 # normal game
 else:
   if options.profile:
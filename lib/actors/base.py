@@ -20,6 +20,10 @@ class Drawable:
       stacking     = 0
       # background objects move slower than foreground
       distance     = 1.0
+      # looks the same as long as the camera does not move
+      static       = False
+      # drawn from a cached parallax layer instead of being an actor
+      layered      = False
 
       ## vertical position
       # wobble up and down to this amount
@@ -50,7 +54,7 @@ class Drawable:
 
           # animation params
           self.start_time = time.time()
-          self.rnd_time_offset = random() * 25.0
+          self.rnd_time_offset = self.world.random() * 25.0
           self.direction  = -1
           self.animate    = self.animate_stop
 
@@ -101,6 +105,13 @@ class Drawable:
           # should overload, if anything to do
           pass
 
+      def wobble(self):
+          """
+          Current offset of a hovering object from its average height
+          """
+          return self.hover_height * \
+                 math.sin((time.time() + self.rnd_time_offset - self.start_time) * 2) * 0.3
+
       def get_xy(self):
           """
           x - center of image
@@ -112,8 +123,7 @@ class Drawable:
 
           # hovering in air (slightly wobbling up and down)
           if self.hover_height:
-            hover = self.hover_height + self.hover_height * \
-                    math.sin((time.time() + self.rnd_time_offset - self.start_time) * 2) * 0.3
+            hover = self.hover_height + self.wobble()
           else:
             hover = 0.0
           
@@ -235,6 +245,8 @@ class Actor(Drawable):
       # play sounds - called from other parts of the class (update() for example)
       def in_range(self):
           return self.pos > self.world.camera.pl_x1() and self.pos < self.world.camera.pl_x2()
+      # sounds only play near the camera, so they must not draw from the
+      # world's random numbers or a replay would depend on where it looked
       def movement_sound(self):
           if self.snd_move and self.in_range() and self.next_sound < self.world.get_time():
             self.next_sound = self.world.get_time() + 1.0 + random()
@@ -281,9 +293,7 @@ class Actor(Drawable):
           self.last_update = now
           
           if self.feel_magic:
-            windfield = self.WindField.value(self.pos)
-            timefield = self.TimeField.value(self.pos)
-            lifefield = self.LifeField.value(self.pos)
+            timefield, windfield, lifefield = self.world.field_values(self)
             
           # update movement
           if self.const_speed or self.const_accel:
@@ -305,6 +315,7 @@ class Actor(Drawable):
             # update position
             self.pos   += magic_mult * self.timediff * (self.speed + magic_speed)
             self.ypos  += magic_mult * self.timediff * self.yspeed
+            self.world.moved_actor(self)
             if self.animate:
               self.movement_sound()
 
@@ -333,8 +344,11 @@ class Actor(Drawable):
           # controlled actors most likely want to do something
           if self.controller:
             if self.last_control + self.controller.control_interval < self.world.get_time():
-              self.controller.update()
-              self.last_control = self.world.get_time()
+              if self.controller.scheduled:
+                self.world.request_control(self)
+              else:
+                self.controller.update()
+                self.last_control = self.world.get_time()
       
       def draw(self):
           """
@@ -455,17 +469,7 @@ class MagicCaster:
 class Background(Drawable):
       distance = 3.0
       stacking = 2
-
-      def draw(self): 
-          img  = self.img_list[0]
-          bg_w = img.get_width() 
-          bg_h = img.get_height()
-          cam  = self.world.camera
-          offset = (cam.pl2sc_x(0) / self.distance) % bg_w - bg_w 
-          count  = int(cam.sc_w() / bg_w) + 2 
-          for i in xrange(count):
-            cam.graphics.blit(img, (offset + i * bg_w, cam.sc_h() - bg_h))
-          return True
+      layered  = True
 
 # controllers
 class Controller:
@@ -473,8 +477,12 @@ class Controller:
       An actor may have a controller that moves it around
       """
       control_interval = 0.1
+      # updated by the world when there is time rather than from the actor
+      scheduled = False
       def __init__(self, puppet):
           self.puppet = puppet
+          # game time from being due to being updated, for scheduled ones
+          self.latency = 0.0
       def __str__(self):
           return "%s" % (self.__class__.__name__)
       def debug_info(self):
@@ -515,7 +523,7 @@ class FSMController(Controller):
           return self.puppet.world.get_time() - self.state_start
       def time_passed(self, duration, rand = 0.0):
           passed = self.puppet.world.get_time() - self.action_time
-          if passed > duration + rand * random():
+          if passed > duration + rand * self.puppet.world.random():
             self.action_time = self.puppet.world.get_time()
             return True
           else:
@@ -1,4 +1,3 @@
-from random import random
 from base import Actor, Controller
 
 # swarming demo
@@ -88,8 +87,8 @@ class BirdFlocker(FlyingController):
                  (FlyingController.debug_info(self), self.xwaypoint, self.ywaypoint)
 
       def random_waypoint(self):
-          self.xwaypoint = random() * self.pos_max_spread - (self.pos_max_spread / 2)
-          self.ywaypoint = random() * self.ypos_upper_bound
+          self.xwaypoint = self.puppet.world.random() * self.pos_max_spread - (self.pos_max_spread / 2)
+          self.ywaypoint = self.puppet.world.random() * self.ypos_upper_bound
 
       def find_offset(self):
           # calculate destination, prefer waypoint
@@ -173,7 +172,7 @@ class BirdPredator(FlyingController):
                  (FlyingController.debug_info(self), self.target.pos, self.target.ypos)
       def random_target(self):
           birds = self.puppet.world.get_actors(include = [SmallBird])
-          self.target = birds[int(random() * len(birds))]
+          self.target = birds[int(self.puppet.world.random() * len(birds))]
       def find_offset(self):
           self.xdiff = self.target.pos  - self.puppet.pos
           self.ydiff = self.target.ypos - self.puppet.ypos
@@ -98,6 +98,8 @@ class MagicParticle(Actor):
           self.mult += self.timediff * multdiff * self.mult_speed
           # acceleration is immediate 
           self.accel = acc * 3.0
+          # field calculations need the new params
+          self.field.update_particle(self)
 
           # if the power drops too low, terminate itself
           if abs(self.mult) < 0.1:
@@ -1,4 +1,3 @@
-from random import random
 from lib import fields
 from base import FSMController, Actor
 from magicballs import *
@@ -185,7 +184,7 @@ class WimpyController(FSMController):
           if self.state == "idle":
             # move around randomly
             if self.time_passed(1.0, 2.0):
-              decision = int(random() * 4) % 4
+              decision = int(self.puppet.world.random() * 4) % 4
               if decision == 0:
                 self.puppet.move_left()
               elif decision == 1:
@@ -252,7 +251,7 @@ class HunterController(FSMController):
             self.puppet.magic.capture(self.shot)
           
       def move_randomly(self):
-          decision = int(random() * 4) % 4
+          decision = int(self.puppet.world.random() * 4) % 4
           if decision == 0:
             self.puppet.move_left()
           elif decision == 1:
@@ -1,9 +1,9 @@
-from random import random
 from base import Controller
 from lib.fields import *
 from lib.actors.mainchars import *
 from lib.actors.magicballs import *
 from lib.debug import dbg
+import bisect, numpy
 
 class Planner(Controller):
       """
@@ -13,6 +13,7 @@ class Planner(Controller):
       selects the most desired actions
       """
       control_interval = 0.05
+      scheduled = True
       def __init__(self, *args):
           Controller.__init__(self, *args)
           self.goals   = {}
@@ -28,14 +29,17 @@ class Planner(Controller):
           self.magic_casters = {}
 
           self.waypoint = self.puppet.pos
+          # counts updates, goal heats are kept for one
+          self.tick = 0
       def set_waypoint(self, waypoint):
           self.waypoint = waypoint
 
       def debug_info(self):
-          return "Planner:\nMove ->%3.2f [%s sc=%3.2f dur=%3.1f]\n%s" % \
-                 (self.move_pos, self.mover, self.move_score, self.puppet.world.get_time() - self.move_time,
+          return "Planner: latency=%.2fs\nMove ->%3.2f [%s sc=%3.2f dur=%3.1f]\n%s" % \
+                 (self.latency, self.move_pos, self.mover, self.move_score, self.puppet.world.get_time() - self.move_time,
                  self.mission.debug_info())
       def update(self):
+          self.tick += 1
           # clear proposals
           self.move_propose  = []
           self.magic_propose = []
@@ -127,6 +131,59 @@ class Planner(Controller):
             self.puppet.dbg("moving left %3.1f -> %3.1f for %s" % (self.puppet.pos, self.movement, self.mover))
             self.puppet.move_left()
 
+class ScaleCurve:
+      """
+      Maps input to output through a list of (input, output) pairs,
+      sorted by input. Below the first and above the last pair the output
+      stays at their value. In between it is either the output of the
+      next pair or, if smooth, interpolated between the pairs.
+      """
+      # below this many inputs a loop is faster than numpy
+      batch_min = 16
+      def __init__(self, scale, smooth = False):
+          self.inputs  = [pair[0] for pair in scale]
+          self.outputs = [pair[1] for pair in scale]
+          self.smooth  = smooth
+          # for larger batches
+          self.input_array  = numpy.array(self.inputs, dtype = float)
+          self.output_array = numpy.array(self.outputs, dtype = float)
+
+      def __call__(self, input):
+          inputs, outputs = self.inputs, self.outputs
+          # first pair with input not below
+          i = bisect.bisect_left(inputs, input)
+          if i == 0:
+            return outputs[0]
+          elif i == len(inputs):
+            return outputs[-1]
+          elif self.smooth:
+            dist = (input - inputs[i - 1]) / (inputs[i] - inputs[i - 1])
+            return outputs[i - 1] + (outputs[i] - outputs[i - 1]) * dist
+          else:
+            return outputs[i]
+
+      def values(self, inputs):
+          """
+          Outputs for a list of inputs, the same as calling for each
+          """
+          if len(inputs) < self.batch_min:
+            return [self(input) for input in inputs]
+          inputs  = numpy.asarray(inputs, dtype = float)
+          points  = self.input_array
+          outputs = self.output_array
+          last = len(points) - 1
+          i = numpy.searchsorted(points, inputs)
+          # the pairs below and above each input, kept in range at the edges
+          above = numpy.minimum(i, last)
+          if not self.smooth:
+            return outputs[above].tolist()
+          below = numpy.maximum(i - 1, 0)
+          span  = numpy.where(above > below, points[above] - points[below], 1.0)
+          dist  = (inputs - points[below]) / span
+          ret   = outputs[below] + (outputs[above] - outputs[below]) * dist
+          ret   = numpy.where(i == 0, outputs[0], numpy.where(i > last, outputs[last], ret))
+          return ret.tolist()
+
 class Goal:
       """
       Set of required functions and helpers for each goal
@@ -143,6 +200,9 @@ class Goal:
           self.prio  = 0.0
           self.heat  = 0.1
           self.score = 0.01
+          # get_heat() result and the controller tick it was computed on
+          self.tick_heat = 0.0
+          self.heat_tick = None
           # priority kept for reference from last round - not to be used
           self.old_prio = True
           # get a sequence number
@@ -186,6 +246,16 @@ class Goal:
           close to 1 when action is required to fulfill the goal
           """
           raise Exception(str(self.__class__.__name__))
+      def heat_now(self):
+          """
+          get_heat() computed at most once per controller update, goals
+          are shared so several parents may ask for it
+          """
+          tick = self.controller.tick
+          if self.heat_tick != tick:
+            self.tick_heat = self.get_heat()
+            self.heat_tick = tick
+          return self.tick_heat
       def dist_prio(self):
           """
           Distribute amount of attention between subgoals
@@ -195,30 +265,6 @@ class Goal:
           """
           pass
 
-      def scale_value(self, input, scale, smooth = False):
-          """
-          helper function, probably does not belong here
-
-          takes a list of (input, output) pairs and calculates
-          input -> output, possibly interpolating
-          """
-          # find the position on scale
-          for i in xrange(len(scale)):
-            if input <= scale[i][0]:
-              break
-          # handle edges
-          if i == 0:
-            return scale[0][1]
-          elif input > scale[i][0]:
-            return scale[i][1]
-          else:
-            # handle normal scale
-            if smooth:
-              dist = (input - scale[i - 1][0]) / (scale[i][0] - scale[i - 1][0])
-              return scale[i - 1][1] + (scale[i][1] - scale[i - 1][1]) * dist
-            else:
-              return scale[i][1]
-
 class TreeGoal(Goal):
       """
       A goal with subgoal management
@@ -247,8 +293,8 @@ class TreeGoal(Goal):
           self.dist_prio()
           for goal in self.subgoals:
             # do not constantly check heat of unimportant goals
-            if random() < max(goal.heat, 0.1):
-              goal.heat  = goal.get_heat()
+            if self.world.random() < max(goal.heat, 0.1):
+              goal.heat  = goal.heat_now()
             goal.score = goal.heat * goal.prio
           self.subgoals.sort(lambda x, y: cmp(y.score, x.score))
           totalscore = self.del_subgoals()
@@ -258,12 +304,12 @@ class TreeGoal(Goal):
           for goal in self.subgoals:
             if goal.score == 0.0:
               continue
-            elif random() < (goal.score / totalscore):
+            elif self.world.random() < (goal.score / totalscore):
               goal.update()
               break
 
           if self.add_subgoals:
-            if random() < self.prob_addsub or len(self.subgoals) < 2:
+            if self.world.random() < self.prob_addsub or len(self.subgoals) < 2:
               self.add_subgoals()
 
       def add_subgoal(self, goaltype, *args):
@@ -297,7 +343,7 @@ class TreeGoal(Goal):
       # useful implementations
       def get_heat_maxchild(self):
           if self.subgoals:
-            return max([goal.get_heat() for goal in self.subgoals] + [0.01])
+            return max([goal.heat_now() for goal in self.subgoals] + [0.01])
           else:
             return 0.01
       def del_subgoals_limiting(self):
@@ -337,6 +383,7 @@ class MovementGoal:
             self.move_to(pos)
 
 class Operate(TreeGoal):
+      heal_curve = ScaleCurve(((0, 1.0), (0.1, 1.0), (0.5, 0.7), (0.8, 0.3), (1.0, 0.01)), smooth = True)
       def __init_goal__(self):
           self.kill  = self.add_subgoal(KillEnemies)
           self.heal  = self.add_subgoal(SetField, self.puppet, self.puppet.LifeField, "-")
@@ -348,7 +395,7 @@ class Operate(TreeGoal):
       def dist_prio(self):
           hp = self.puppet.hp / self.puppet.initial_hp
 
-          healprio  = self.scale_value(hp, ((0, 1.0), (0.1, 1.0), (0.5, 0.7), (0.8, 0.3), (1.0, 0.01)), smooth = True)
+          healprio  = self.heal_curve(hp)
           fightprio = (1 - healprio) * 0.8
           walkprio  = (1 - healprio) * 0.2
 
@@ -367,11 +414,12 @@ class Operate(TreeGoal):
 # action goals
 
 class KillEnemies(TreeGoal):
+      distance_curve = ScaleCurve(((0, 0.3), (15, 0.3), (30, 0.9), (60, 0.7), (75, 0.1), (100, 0.0)))
       del_subgoals = TreeGoal.del_subgoals_limiting
       def add_subgoals(self):
           # find unhandled prey
           pos = self.puppet.pos
-          targets = self.world.get_actors(pos - 75.0, pos + 75.0, include = self.puppet.prey)
+          targets = self.world.perceive().actors(pos - 75.0, pos + 75.0, self.puppet.prey)
           for target in targets:
             targetting = False
             for goal in self.subgoals:
@@ -389,11 +437,11 @@ class KillEnemies(TreeGoal):
           prios = []
           total = 0.0
           # dropping base multiplied by distance scale
+          diffs = [abs(self.puppet.pos - goal.target.pos) for goal in self.subgoals]
+          scales = self.distance_curve.values(diffs)
           for i in xrange(n_goals):
-            goal = self.subgoals[i]
             prios.append(0.25 + (float(n_goals - i) / n_goals) * 0.5)
-            diff = abs(self.puppet.pos - goal.target.pos)
-            prios[i] *= self.scale_value(diff, ((0, 0.3), (15, 0.3), (30, 0.9), (60, 0.7), (75, 0.1), (100, 0.0)))
+            prios[i] *= scales[i]
             total += prios[i]
           if total == 0:
             coef = 0.0
@@ -412,11 +460,11 @@ class KillEnemy(TreeGoal):
             return 0.0
           if len(self.subgoals) == 0:
             return 1.0
-          return max([g.get_heat() for g in self.subgoals])
+          return max([g.heat_now() for g in self.subgoals])
       def dist_prio(self):
           if not self.subgoals:
             return
-          if self.fireball.get_heat() > self.distance.get_heat():
+          if self.fireball.heat_now() > self.distance.heat_now():
             self.fireball.prio += self.prio * 0.7
             self.distance.prio += self.prio * 0.3
           else:
@@ -430,11 +478,12 @@ class Heal(TreeGoal):
 # movement goals
 
 class FightingDistance(Goal, MovementGoal):
+      heat_curve = ScaleCurve(((0, 1.0), (10, 0.5), (35, 0.1), (65, 0.1), (75, 0.5), (90, 1.0)))
       def __init_goal__(self, target):
           self.target = target
       def get_heat(self):
           diff = abs(self.target.pos - self.puppet.pos)
-          return self.scale_value(diff, ((0, 1.0), (10, 0.5), (35, 0.1), (65, 0.1), (75, 0.5), (90, 1.0)))
+          return self.heat_curve(diff)
       def update(self):
           diff = abs(self.target.pos - self.puppet.pos)
           if 35.0 < diff < 65.0:
@@ -445,9 +494,10 @@ class FightingDistance(Goal, MovementGoal):
             self.move_to(self.target.pos)
 
 class GotoWaypoint(Goal, MovementGoal):
+      heat_curve = ScaleCurve(((0, 0.01), (15, 0.1), (50, 0.5), (75, 1.0)), smooth = True)
       def get_heat(self):
           diff = abs(self.controller.waypoint - self.puppet.pos)
-          return self.scale_value(diff, ((0, 0.01), (15, 0.1), (50, 0.5), (75, 1.0)), smooth = True)
+          return self.heat_curve(diff)
       def update(self):
           self.move_to(self.controller.waypoint)
 
@@ -455,11 +505,12 @@ class WanderAround(Goal, MovementGoal):
       def get_heat(self):
           return 0.5
       def update(self):
-          self.move_to(self.puppet.pos + random() * 50 - 25)
+          self.move_to(self.puppet.pos + self.world.random() * 50 - 25)
 
 class FormBand(Goal, MovementGoal):
       min_dist  = 10.0
       save_time = 2.0
+      heat_curve = ScaleCurve(((0, 0.01), (2, 0.1), (10, 0.5), (25, 1.0)), smooth = True)
       def __init_goal__(self):
           self.saved_band_pos = self.puppet.pos
           self.last_save_time = 0.0
@@ -471,7 +522,7 @@ class FormBand(Goal, MovementGoal):
           pos = self.puppet.pos
           avg     = 0.0
           closest = pos + 75.0
-          friends = self.world.get_actors(pos - 75.0, pos + 75.0, include = [self.puppet.__class__])
+          friends = self.world.perceive().actors(pos - 75.0, pos + 75.0, [self.puppet.__class__])
           for friend in friends:
             if friend == self.puppet:
               continue
@@ -480,12 +531,12 @@ class FormBand(Goal, MovementGoal):
               closest = friend.pos
 
           # do not get too tight
-          diff = closest - pos + random() - 0.5
+          diff = closest - pos + self.world.random() - 0.5
           if abs(diff) < self.min_dist:
             if diff > 0:
-              dst = pos - (self.min_dist - abs(diff)) - random()
+              dst = pos - (self.min_dist - abs(diff)) - self.world.random()
             else:
-              dst = pos + (self.min_dist - abs(diff)) + random()
+              dst = pos + (self.min_dist - abs(diff)) + self.world.random()
             self.saved_band_pos = dst
           # band together
           elif avg == 0:
@@ -497,12 +548,13 @@ class FormBand(Goal, MovementGoal):
           
       def get_heat(self):
           diff = abs(self.band_pos() - self.puppet.pos)
-          return self.scale_value(diff, ((0, 0.01), (2, 0.1), (10, 0.5), (25, 1.0)), smooth = True)
+          return self.heat_curve(diff)
       def update(self):
           self.move_to(self.band_pos())
 
 class AvoidFireballs(Goal, MovementGoal):
       save_time = 2.0
+      heat_curve = ScaleCurve(((0, 0.01), (0.5, 0.3), (1, 1.0)), smooth = True)
       def __init_goal__(self):
           self.saved_best_move = (0.0, self.puppet.pos)
           self.last_save_time = 0.0
@@ -511,8 +563,11 @@ class AvoidFireballs(Goal, MovementGoal):
           if self.last_save_time > self.world.get_time() - self.save_time:
             return self.saved_best_move
           pos  = self.puppet.pos
-          base = self.puppet.LifeField.value(pos)
-          values = [(ofs, self.puppet.LifeField.value(pos + ofs) - base) for ofs in [-15, -7, -3, +3, +7, +15]]
+          offsets = [-15, -7, -3, +3, +7, +15]
+          # all in one batch, the first is the current position
+          samples = self.puppet.LifeField.values([pos] + [pos + ofs for ofs in offsets]).tolist()
+          base = samples[0]
+          values = [(ofs, value - base) for ofs, value in zip(offsets, samples[1:])]
           best   = pos
           worth  = 0.0
           for ofs, diff in values:
@@ -526,7 +581,7 @@ class AvoidFireballs(Goal, MovementGoal):
           return self.saved_best_move
       def get_heat(self):
           worth, pos = self.best_move()
-          return self.scale_value(worth, ((0, 0.01), (0.5, 0.3), (1, 1.0)), smooth = True)
+          return self.heat_curve(worth)
       def update(self):
           worth, pos = self.best_move()
           self.move_to(pos)
@@ -534,6 +589,10 @@ class AvoidFireballs(Goal, MovementGoal):
 # magic goals
 
 class SetField(TreeGoal):
+      # ball distance to target -> priority
+      repel_curve   = ScaleCurve(((0, 2), (5, 1), (15, 0.7), (50, 0.0)), smooth = True)
+      attract_curve = ScaleCurve(((0, 0.1), (3, 2), (15, 1), (50, 0.7), (100, 0.0)), smooth = True)
+      power_curve   = ScaleCurve(((0, 2), (15, 1), (50, 0.3), (100, 0.0)), smooth = True)
       def __init_goal__(self, target, field, value):
           self.target = target
           self.field  = field
@@ -544,7 +603,7 @@ class SetField(TreeGoal):
           return (ball.mult > 0 and self.value == "-") or (ball.mult < 0 and self.value == "+")
       def add_subgoals(self):
           pos = self.target.pos
-          balls = self.world.get_actors(pos - 75.0, pos + 75.0, include = [field2ball(self.field)])
+          balls = self.world.perceive().balls(pos - 75.0, pos + 75.0, self.field)
           for ball in balls:
             repel = self.wrong_sign(ball)
             m = p = False
@@ -559,12 +618,12 @@ class SetField(TreeGoal):
               self.add_subgoal(PowerBall, ball, self.value)
 
           # if there are no balls or just to suprise
-          if (len(self.subgoals) == 0 or random() > 0.95) and self.heat > 0.1:
+          if (len(self.subgoals) == 0 or self.world.random() > 0.95) and self.heat > 0.1:
             self.add_subgoal(CreateBall, field2ball(self.field))
       def get_heat(self):
           if len(self.subgoals) == 0:
             return 1.0
-          return max([g.get_heat() for g in self.subgoals])
+          return max([g.heat_now() for g in self.subgoals])
       def dist_prio(self):
           if len(self.subgoals) == 0:
             return
@@ -582,13 +641,13 @@ class SetField(TreeGoal):
               if isinstance(goal, MoveBall):
                 if goal.repel == self.wrong_sign(goal.ball):
                   if goal.repel:
-                    prios[i] *= self.scale_value(diff, ((0, 2), (5, 1), (15, 0.7), (50, 0.0)), smooth = True)
+                    prios[i] *= self.repel_curve(diff)
                   else:
-                    prios[i] *= self.scale_value(diff, ((0, 0.1), (3, 2), (15, 1), (50, 0.7), (100, 0.0)), smooth = True)
+                    prios[i] *= self.attract_curve(diff)
                 else:
                   prios[i] = 0.0
               elif isinstance(goal, PowerBall):
-                prios[i] *= self.scale_value(diff, ((0, 2), (15, 1), (50, 0.3), (100, 0.0)), smooth = True)
+                prios[i] *= self.power_curve(diff)
             total += prios[i]
           if total == 0.0:
             return
@@ -620,6 +679,8 @@ class MagicGoal:
           self.controller.propose_magic(self, ("power", ball, value))
 
 class MoveBall(Goal, MagicGoal):
+      repel_curve   = ScaleCurve(((0, 1.0), (1, 0.8), (5, 0.5), (10, 0.3), (25, 0.2), (90, 0.0)))
+      attract_curve = ScaleCurve(((0, 0.1), (1, 0.5), (5, 1.0), (10, 0.3), (90, 0.3), (150, 0.0)))
       def __init_goal__(self, ball, target, repel):
           self.ball   = ball
           self.target = target
@@ -651,12 +712,13 @@ class MoveBall(Goal, MagicGoal):
             return 0.0
           diff = self.target_pos() - (self.ball.pos + self.ball.speed)
           if self.repel:
-            heat = self.scale_value(abs(diff), ((0, 1.0), (1, 0.8), (5, 0.5), (10, 0.3), (25, 0.2), (90, 0.0)))
+            heat = self.repel_curve(abs(diff))
           else:
-            heat = self.scale_value(abs(diff), ((0, 0.1), (1, 0.5), (5, 1.0), (10, 0.3), (90, 0.3), (150, 0.0)))
+            heat = self.attract_curve(abs(diff))
           return heat
 
 class PowerBall(Goal, MagicGoal):
+      heat_curve = ScaleCurve(((0, 0.01), (3, 0.2), (10, 0.6)), smooth = True)
       def __init_goal__(self, ball, value):
           self.ball  = ball
           self.value = value
@@ -670,7 +732,7 @@ class PowerBall(Goal, MagicGoal):
           if self.ball.dead:
             return 0.0
           diff = abs(self.dest_value() - self.ball.mult)
-          return self.scale_value(abs(diff), ((0, 0.01), (3, 0.2), (10, 0.6)), smooth = True)
+          return self.heat_curve(abs(diff))
       def dist_prio(self): pass
 
 # actors
@@ -2,7 +2,7 @@ from base import Drawable
 
 # scenery
 class Scenery(Drawable):
-      pass
+      static       = True
 class Tree(Scenery):
       sprite_names = ["tree"]
       stacking     = 10
@@ -10,12 +10,14 @@ class Post(Scenery):
       sprite_names = ["post"]
       animate_stop = True
       stacking     = 15
+      static       = False
 class Hut(Scenery):
       sprite_names = ["hut"]
       stacking     = 15
 
 class Sky(Drawable):
       from_ceiling = True
+      layered      = True
 class Sun(Sky):
       distance     = 4.0
       sprite_names = ["sun"]
@@ -35,16 +37,7 @@ class Cloud(Sky):
 class Background(Drawable):
       distance = 3.0
       stacking = 2
-
-      def draw(self): 
-          img  = self.img_list[0]
-          bg_w = img.get_width() 
-          bg_h = img.get_height()
-          cam  = self.world.camera
-          offset = (cam.pl2sc_x(0) / self.distance) % bg_w - bg_w 
-          count  = int(cam.sc_w() / bg_w) + 2 
-          for i in xrange(count):
-            cam.graphics.blit(img, (offset + i * bg_w, cam.sc_h() - bg_h))
+      layered  = True
 
 class BackgroundHills(Background):
       sprite_names = ["hills"]
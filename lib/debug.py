@@ -61,15 +61,16 @@ class DrawDebug:
 
       def draw(self, text, x, y, black = False, color = (255, 255, 255, 255)):
           lines = self.split(text)
-          line_imgs = []
-          for line in lines:
-            line_imgs.append(self.rsc.fonts.debugfont.render(line, True, color))
-          for i in xrange(len(line_imgs)):
-            img = line_imgs[i]
+          font = self.rsc.fonts.debugfont
+          graphics = self.rsc.graphics
+          # backgrounds first so the text can be drawn in one go
+          if black:
+            for i in xrange(len(lines)):
+              width, height = font.size(lines[i])
+              graphics.fill((0,0,0), (x, y + i * self.line_height, width, height))
+          for i in xrange(len(lines)):
             txt_y = y + i * self.line_height
-            if black:
-              self.rsc.graphics.fill((0,0,0), (x, txt_y, img.get_width(), img.get_height()))
-            self.rsc.graphics.blit(img, (x, txt_y))
+            graphics.text(font, lines[i], (x, txt_y), color)
           return txt_y + self.line_height
 
       def draw_msg(self, text, obj_x = None, obj_y = None):
@@ -221,11 +222,20 @@ class AvgValue(Stat):
       e = 0.95
       def __init__(self):
           self.value = None
+          # for long term averages
+          self.total = 0.0
+          self.count = 0
       def set(self, value):
           if self.value is None:
             self.value = value
           else:
             self.value = self.e * self.value + (1 - self.e) * value
+          self.total += value
+          self.count += 1
+      def mean(self):
+          if self.count == 0:
+            return 0.0
+          return self.total / self.count
 
 class Timer(Stat):
       unit = "ms"
@@ -233,6 +243,9 @@ class Timer(Stat):
       def __init__(self):
           self.start()
           self.value = 0.0
+          # for long term averages
+          self.total = 0.0
+          self.count = 0
       def __str__(self):
           return "%.3f" % (self.get())
       def start(self):
@@ -242,6 +255,12 @@ class Timer(Stat):
           self.end_time = time.time()
           value = (self.end_time - self.start_time) * 1000.0
           self.value = self.value * self.e + value * (1 - self.e)
+          self.total += value
+          self.count += 1
+      def mean(self):
+          if self.count == 0:
+            return 0.0
+          return self.total / self.count
 
 class StatSet:
       """
@@ -1,29 +1,37 @@
 #!/usr/bin/python
 
-import pygame, math, time
+import pygame, math, time, numpy
 from random import random
 import graphics
 
-global circle_cache, circle_cache_hit, circle_cache_miss, draw_effects
+global circle_cache, circle_cache_hit, circle_cache_miss, circle_cache_evict, draw_effects
+# (color, radius, blur) -> [image, last use], least recently used are evicted
 circle_cache = {}
-circle_cache_hit = circle_cache_miss = 0
+circle_cache_hit = circle_cache_miss = circle_cache_evict = 0
+circle_cache_bytes     = 0
+circle_cache_max_size  = 512
+circle_cache_max_bytes = 8 * 1024 * 1024
 draw_effects = True
+def round_color(color):
+    """
+    Color in the steps that circles are cached for
+    """
+    return tuple([min(int(value / 8 + 0.5) * 8, 255) for value in color])
+
 def get_circle(color, radius, graphics, blur = 0):
-    global circle_cache, circle_cache_hit, circle_cache_miss
-    # color accuracy
-    c = tuple()
-    for i in xrange(4):
-      colval = int(color[i] / 8 + 0.5) * 8
-      if colval > 255: colval = 255
-      c += (colval,)
-    color  = tuple(c)
-    radius = int(radius)
-    blur   = int(blur)
+    return cached_circle(round_color(color[:4]), int(radius), int(blur), graphics)
 
+def cached_circle(color, radius, blur, graphics):
+    """
+    get_circle() for a color already rounded with round_color()
+    """
+    global circle_cache, circle_cache_hit, circle_cache_miss
     # try to get it from cache
-    if circle_cache.has_key((color, radius, blur)):
+    entry = circle_cache.get((color, radius, blur))
+    if entry:
       circle_cache_hit += 1
-      return circle_cache[(color, radius, blur)]
+      entry[1] = circle_cache_hit + circle_cache_miss
+      return entry[0]
     else:
       circle_cache_miss += 1
       s = pygame.surface.Surface((radius * 2, radius * 2), pygame.SRCALPHA, 32)
@@ -34,24 +42,17 @@ def get_circle(color, radius, graphics, blur = 0):
 
       # blur the edges of the circle (just set the alpha)
       if blur:
-        alphas      = pygame.surfarray.pixels_alpha(s)
-        color_alpha = color[3]
-        center      = radius
-        for y in xrange(radius):
-          for x in xrange(radius):
-            if x + y < radius - blur:
-              pass
-            dist = ((x - center) ** 2 + (y - center) ** 2) ** 0.5
-            if dist < radius - blur:
-              pass
-            elif dist > radius + 0.5:
-              pass
-            else:
-              alpha = max(radius - dist, 0.0) / (blur + 1) * color_alpha
-              alphas[y][x] = alpha
-              alphas[2 * center - 1 - y][x] = alpha
-              alphas[y][2 * center - 1 - x] = alpha
-              alphas[2 * center - 1 - y][2 * center - 1 - x] = alpha
+        alphas = pygame.surfarray.pixels_alpha(s)
+        # one quarter of the circle, mirrored to the others
+        y, x = numpy.ogrid[:radius, :radius]
+        dist = numpy.sqrt((x - radius) ** 2.0 + (y - radius) ** 2.0)
+        edge = (dist >= radius - blur) & (dist <= radius + 0.5)
+        fade = numpy.maximum(radius - dist, 0.0) / (blur + 1) * color[3]
+        edge = numpy.hstack((edge, edge[:, ::-1]))
+        edge = numpy.vstack((edge, edge[::-1]))
+        fade = numpy.hstack((fade, fade[:, ::-1]))
+        fade = numpy.vstack((fade, fade[::-1]))
+        alphas[edge] = fade[edge]
 
       # optimize for screen
       if graphics and graphics.screen:
@@ -59,37 +60,92 @@ def get_circle(color, radius, graphics, blur = 0):
       s = graphics.image(s)
 
       # save to cache
-      circle_cache[(color, radius, blur)] = s
+      circle_cache[(color, radius, blur)] = [s, circle_cache_hit + circle_cache_miss]
+      add_circle_bytes(radius)
       return s
 
-class Dot:
-      img_cache_time = 0.1
-      def __init__(self, x, y, xs, ys, age = 0.0):
-          self.x    = x
-          self.y    = y
-          self.xs   = xs
-          self.ys   = ys
-          self.age  = age
-          # cached image
-          self.img  = False
-          self.ts   = 0
-          self.seed  = self.xseed = random() * 100
-          self.yseed = random() * 100
-          
+def add_circle_bytes(radius):
+    global circle_cache_bytes
+    circle_cache_bytes += 16 * radius ** 2
+    if len(circle_cache) > circle_cache_max_size or circle_cache_bytes > circle_cache_max_bytes:
+      evict_circles()
+
+def evict_circles():
+    """
+    Drop the least recently used quarter of the circle cache, images
+    (and their textures) are freed once nothing else holds them
+    """
+    global circle_cache_bytes, circle_cache_evict
+    entries = sorted(circle_cache.items(), key = lambda item: item[1][1])
+    for key, entry in entries[:max(1, len(entries) / 4)]:
+      del circle_cache[key]
+      circle_cache_bytes -= 16 * key[1] ** 2
+      circle_cache_evict += 1
+
+def circle_stats():
+    stats = "CIRCLES: %u (%uKB) hit=%u miss=%u evicted=%u" % \
+            (len(circle_cache), circle_cache_bytes / 1024, circle_cache_hit, circle_cache_miss, circle_cache_evict)
+    if graphics.atlases:
+      stats += "  " + graphics.atlas_stats()
+    return stats
+
+def warm_up(graphics):
+    """
+    Create the circles the particle effects will ask for, so that
+    they are not made in the middle of a level
+    """
+    for Effect in (Fire, Nature, Wind, Energy):
+      Effect().warm_up(graphics)
+
 class ParticleEffect:
+      """
+      Dots are kept as arrays (structure of arrays) in a ring buffer of
+      fixed capacity, new dots overwrite the oldest slot
+      """
       normal_particles = 50.0
       max_width        = 50.0
+      # at most one dot is born per update, so 2s of 50 updates/s fit
+      capacity         = 128
+      img_cache_time   = 0.1
       def __init__(self, magic = None, intensity = 1.0, max_age = 2.0, xofs = 100.0):
           # how many to generate per second
           self.intensity = intensity
           # when to remove the dot
           self.max_age   = max_age
           self.last_time = time.time()
-          self.dots      = []
+          # dot arrays
+          self.x     = self.alloc()
+          self.y     = self.alloc()
+          self.xs    = self.alloc()
+          self.ys    = self.alloc()
+          self.age   = self.alloc()
+          self.seed  = self.alloc()
+          self.xseed = self.alloc()
+          self.yseed = self.alloc()
+          # where the magic was when the dot was born
+          self.pos   = self.alloc()
+          self.hover = self.alloc()
+          self.alive = numpy.zeros(self.capacity, bool)
+          # slot the next dot goes to
+          self.next  = 0
+          # cached images
+          self.img   = [None] * self.capacity
+          self.ts    = self.alloc()
           # for game
           self.magic     = magic
           # for standalone tester
           self.xofs      = xofs
+          # random numbers from the world, if there is one
+          if magic is not None:
+            self.random = magic.world.random
+          else:
+            self.random = random
+
+      def alloc(self, *shape):
+          """
+          Array with a row for each dot slot
+          """
+          return numpy.zeros((self.capacity,) + shape)
 
       def update(self, intensity = None):
           # override one passed at init
@@ -104,30 +160,53 @@ class ParticleEffect:
           timediff = new_time - self.last_time
           self.last_time = new_time
 
-          # update each dot
-          i = 0
-          dotcount = len(self.dots)
-          while i < dotcount:
-            dot = self.dots[i]
-            dot.age += timediff
-            self.update_speed(dot, timediff)
-            dot.x += dot.xs * timediff
-            dot.y += dot.ys * timediff
+          # update all dots at once, dead slots just go along
+          if self.alive.any():
+            self.age += timediff
+            self.update_speed(timediff)
+            self.x += self.xs * timediff
+            self.y += self.ys * timediff
             # remove dots: old or far away
-            if dot.age > self.max_age or abs(dot.x) > self.max_width:
-              self.dots.pop(i)
-              dotcount -= 1
-            else:
-              i += 1
+            self.alive &= (self.age <= self.max_age) & (numpy.abs(self.x) <= self.max_width)
 
           # generate new dots
-          if random() < self.persec * timediff:
-            dot = self.gen_dot()
+          if self.random() < self.persec * timediff:
+            i = self.next
+            self.next = (i + 1) % self.capacity
+            self.age[i] = 0.0
+            self.ts[i]  = -numpy.inf
+            self.gen_dot(i)
+            self.seed[i] = self.xseed[i] = self.random() * 100
+            self.yseed[i] = self.random() * 100
             if self.magic is not None:
-              dot.pos   = self.magic.pos
-              dot.hover = self.magic.hover_height
-            self.dots.append(dot)
-            
+              self.pos[i]   = self.magic.pos
+              self.hover[i] = self.magic.hover_height
+            self.alive[i] = True
+
+      def warm_up(self, graphics):
+          """
+          Get the circles of dots with ages over the whole lifetime
+          """
+          dots = numpy.arange(self.capacity)
+          self.age[:] = numpy.linspace(0.0, self.max_age, self.capacity)
+          self.warm_up_dots()
+          colors       = self.get_color(dots)
+          radius, blur = self.get_radius(dots)
+          for c, r, b in zip(colors.tolist(), radius.tolist(), blur.tolist()):
+            get_circle(c, r, graphics, b)
+      def warm_up_dots(self):
+          """
+          Fill in the dot arrays that get_color and get_radius need
+          """
+          pass
+
+      def dots(self):
+          """
+          Slots of the live dots, oldest first
+          """
+          order = numpy.roll(numpy.arange(self.capacity), -self.next)
+          return order[self.alive[order]]
+
       def draw(self, graphics):
           if not draw_effects:
             return
@@ -135,63 +214,55 @@ class ParticleEffect:
             now = self.magic.world.get_time()
           else:
             now = time.time()
-          for dot in self.dots:
-            if dot.ts + dot.img_cache_time > now and dot.img:
-              s = dot.img
-            else:
-              color        = self.get_color(dot)
-              radius, blur = self.get_radius(dot)
-              # TODO: there really should be a better way to do this (but apparently there isn't?)
-              s = get_circle(color, radius, graphics, blur)
-              dot.ts  = now
-              dot.img = s
-            if self.magic:
-              cam = self.magic.world.camera
-              x = cam.pl2sc_x(dot.pos) + dot.x - s.get_width() / 2
-              y = cam.sc_h() - dot.hover + dot.y - s.get_height() / 2
-              cam.graphics.blit(s, (x, y))
-            else:
-              graphics.blit(s, (dot.x + self.xofs - s.get_width() / 2, 100 + dot.y - s.get_height() / 2))
+          dots = self.dots()
+          if not len(dots):
+            return
+          stale = dots[self.ts[dots] + self.img_cache_time <= now]
+          if len(stale):
+            colors       = self.get_color(stale)
+            radius, blur = self.get_radius(stale)
+            # TODO: there really should be a better way to do this (but apparently there isn't?)
+            for i, c, r, b in zip(stale.tolist(), colors.tolist(), radius.tolist(), blur.tolist()):
+              self.img[i] = get_circle(c, r, graphics, b)
+            self.ts[stale] = now
+          if self.magic:
+            cam = self.magic.world.camera
+            xs  = cam.pl2sc_x(self.pos[dots]) + self.x[dots]
+            ys  = cam.sc_h() - self.hover[dots] + self.y[dots]
+            graphics = cam.graphics
+          else:
+            xs  = self.x[dots] + self.xofs
+            ys  = 100 + self.y[dots]
+          img  = self.img
+          blit = graphics.blit
+          for i, x, y in zip(dots.tolist(), xs.tolist(), ys.tolist()):
+            s = img[i]
+            blit(s, (x - s.get_width() / 2, y - s.get_height() / 2))
 
 # A template
 class Dummy(ParticleEffect):
-      def gen_dot(self):
-          return Dot(0, 0, 0, 0)
-      def get_radius(self, dot):
-          return 1, 0
-      def get_color(self, dot):
-          return (0, 0, 0, 0)
-      def update_speed(self, dot, timediff):
+      def gen_dot(self, i):
+          self.x[i] = self.y[i] = self.xs[i] = self.ys[i] = 0
+      def get_radius(self, dots):
+          return numpy.ones(len(dots)), numpy.zeros(len(dots))
+      def get_color(self, dots):
+          return numpy.zeros((len(dots), 4), int)
+      def update_speed(self, timediff):
           pass
 
 class Gradient:
       def __init__(self, gradient):
           self.gradient = gradient
+          points = numpy.array(gradient, dtype = float)
+          self.positions = points[:, 0]
+          self.colors    = points[:, 1:]
       def get_color(self, pos):
-          # find the two gradients to blend between
-          if self.gradient[0][0] >= pos:
-            return self.gradient[0][1:]
-          elif self.gradient[len(self.gradient) - 1][0] <= pos:
-            return self.gradient[len(self.gradient) - 1][1:]
-          else:
-            i = 0
-            while i < len(self.gradient):
-              g = self.gradient[i]
-              if pos < g[0]:
-                p2, c2 = g[0], g[1:]
-                glast = self.gradient[i - 1]
-                p1, c1 = glast[0], glast[1:]
-                break
-              elif g[0] == pos:
-                return g[1:]
-              i += 1
-
-          # do the blend
-          k = (pos - p1) / (p2 - p1)
-          c = [] 
-          for i in xrange(len(c1)):
-            c.append(int(c1[i] + k * (c2[i] - c1[i])))
-          return tuple(c)
+          """
+          Blended colors at an array of positions
+          """
+          # positions past either end get the end colors
+          c = [numpy.interp(pos, self.positions, channel) for channel in self.colors.T]
+          return numpy.array(c).T.astype(int)
           
 class Fire(ParticleEffect):
       def __init__(self, *args, **kwargs):
@@ -204,30 +275,28 @@ class Fire(ParticleEffect):
             ( 1.5, 128, 128, 128, 255),
             ( 2.0, 128, 128, 128,   0)
             ))
-      def gen_dot(self):
-          x = random() * 10.0 - 5.0
-          y = random() * 10.0 - 5.0
-          xs = random() * 5.0 - 2.5
-          ys = random() * 5.0 - 60.0
-          return Dot(x, y, xs, ys)
-      def get_radius(self, dot):
-          if dot.age < 0.1:
-            return 10.0, 5.0
-          elif dot.age > 1.5:
-            r = max(20.0 - (dot.age - 1.5) * 30, 5)
-          else:
-            r = min(5.0 + dot.age * 10.0, 20)
-          return r, r * 2.0
-      def get_color(self, dot):
-          return self.firegradient.get_color(dot.age)
-      def update_speed(self, dot, timediff):
-          dot.ys += timediff * 25
-          dot.xs += math.sin(dot.seed + dot.age * 15.0) * 20
-          dot.xs *= 0.95
+      def gen_dot(self, i):
+          self.x[i]  = self.random() * 10.0 - 5.0
+          self.y[i]  = self.random() * 10.0 - 5.0
+          self.xs[i] = self.random() * 5.0 - 2.5
+          self.ys[i] = self.random() * 5.0 - 60.0
+      def get_radius(self, dots):
+          age = self.age[dots]
+          r = numpy.where(age > 1.5, numpy.maximum(20.0 - (age - 1.5) * 30, 5),
+                                     numpy.minimum(5.0 + age * 10.0, 20))
+          young = age < 0.1
+          return numpy.where(young, 10.0, r), numpy.where(young, 5.0, r * 2.0)
+      def get_color(self, dots):
+          return self.firegradient.get_color(self.age[dots])
+      def update_speed(self, timediff):
+          self.ys += timediff * 25
+          self.xs += numpy.sin(self.seed + self.age * 15.0) * 20
+          self.xs *= 0.95
 
 class Nature(ParticleEffect):
       def __init__(self, *args, **kwargs):
           ParticleEffect.__init__(self, *args, **kwargs)
+          self.radius = self.alloc(2)
           self.naturegradient1 = Gradient((
             (   0,  32, 192,   0, 255),
             (0.25,  32, 192,   0, 255),
@@ -239,62 +308,83 @@ class Nature(ParticleEffect):
             (   1, 128,  64,   0, 128),
             (   2,  64,  32,   0,  64),
             ))
-      def gen_dot(self):
-          dot = Dot(random() * 10 - 5, random() * 25.0, random() * 2.0 - 1.0, 5.0 + random() * 1.0)
-          if random() < 0.5:
-            dot.radius = 3.0, 1.0
-          else:
-            dot.radius = 10.0, 5.0
-          return dot
-      def get_radius(self, dot):
-          return dot.radius
-      def get_color(self, dot):
-          if dot.radius == 1:
-            return self.naturegradient1.get_color(dot.age)
+      def gen_dot(self, i):
+          self.x[i]  = self.random() * 10 - 5
+          self.y[i]  = self.random() * 25.0
+          self.xs[i] = self.random() * 2.0 - 1.0
+          self.ys[i] = 5.0 + self.random() * 1.0
+          if self.random() < 0.5:
+            self.radius[i] = 3.0, 1.0
           else:
-            return self.naturegradient2.get_color(dot.age)
-      def update_speed(self, dot, timediff):
-          dot.xs = math.sin(dot.seed + dot.age * 6) * 10.0 + math.sin(dot.seed + dot.age * 4) * 15.0
-          dot.ys += 5.0 * timediff
+            self.radius[i] = 10.0, 5.0
+      def warm_up_dots(self):
+          self.radius[0::2] = 3.0, 1.0
+          self.radius[1::2] = 10.0, 5.0
+      def get_radius(self, dots):
+          return self.radius[dots].T
+      def get_color(self, dots):
+          age = self.age[dots]
+          small = (self.radius[dots, 0] == 1)[:, numpy.newaxis]
+          return numpy.where(small, self.naturegradient1.get_color(age), self.naturegradient2.get_color(age))
+      def update_speed(self, timediff):
+          self.xs = numpy.sin(self.seed + self.age * 6) * 10.0 + numpy.sin(self.seed + self.age * 4) * 15.0
+          self.ys += 5.0 * timediff
 
 class Wind(ParticleEffect):
       normal_particles = 50
-      def gen_dot(self):
-          x = random() * 10 - 5.0
-          y = random() * 10
-          dot = Dot(x, y, 0, 0)
-          if random() < 0.8:
-            dot.radius = 1, 0
+      def __init__(self, *args, **kwargs):
+          ParticleEffect.__init__(self, *args, **kwargs)
+          self.radius = self.alloc(2)
+      def gen_dot(self, i):
+          self.x[i]  = self.random() * 10 - 5.0
+          self.y[i]  = self.random() * 10
+          self.xs[i] = self.ys[i] = 0
+          if self.random() < 0.8:
+            self.radius[i] = 1, 0
           else:
-            dot.radius = 4, 2
-          return dot
-      def get_radius(self, dot):
-          return dot.radius
-      def get_color(self, dot):
-          return (0, 0, 0, 64)
-      def update_speed(self, dot, timediff):
+            self.radius[i] = 4, 2
+      def warm_up_dots(self):
+          self.radius[0::2] = 1, 0
+          self.radius[1::2] = 4, 2
+      def get_radius(self, dots):
+          return self.radius[dots].T
+      def get_color(self, dots):
+          return numpy.tile((0, 0, 0, 64), (len(dots), 1))
+      def update_speed(self, timediff):
           if self.intensity > 0: mult = -1
           else: mult = 1
-          dot.xs = mult * math.cos(dot.seed + dot.age * 12.0 * abs(self.intensity)) * 100.0 * abs(self.intensity)
-          dot.ys = math.sin(dot.seed + dot.age * 12.0 * abs(self.intensity)) * 100.0 * abs(self.intensity)
+          angle = self.seed + self.age * 12.0 * abs(self.intensity)
+          self.xs = mult * numpy.cos(angle) * 100.0 * abs(self.intensity)
+          self.ys = numpy.sin(angle) * 100.0 * abs(self.intensity)
 
 class Energy(ParticleEffect):
-      def gen_dot(self):
-          dot = Dot(random() * 10.0 - 5.0, random() * 10.0 - 5.0, 0, 0)
-          dot.xdiff = random() / 5.0
-          light = 32 * random()
+      def __init__(self, *args, **kwargs):
+          ParticleEffect.__init__(self, *args, **kwargs)
+          self.xdiff = self.alloc()
+          self.color = self.alloc(4)
+      def gen_dot(self, i):
+          self.x[i]  = self.random() * 10.0 - 5.0
+          self.y[i]  = self.random() * 10.0 - 5.0
+          self.xs[i] = self.ys[i] = 0
+          self.xdiff[i] = self.random() / 5.0
+          light = 32 * self.random()
           if self.intensity > 0:
-            dot.color = (255 - random() * 96, 32 + light, 32 + light, 32)
+            self.color[i] = (255 - self.random() * 96, 32 + light, 32 + light, 32)
           else:
-            dot.color = (32 + light, 32 + light, 255 - random() * 96, 32)
-          return dot
-      def get_radius(self, dot):
-          return math.sin(6 * dot.age + dot.xseed) * 5.0 + 5.0, 3.0
-      def get_color(self, dot):
-          return dot.color
-      def update_speed(self, dot, timediff):
-          dot.xs = math.sin(6 * dot.age + dot.xseed * dot.xdiff) * 20.0
-          dot.ys = math.sin(6 * dot.age + dot.yseed) * 20.0
+            self.color[i] = (32 + light, 32 + light, 255 - self.random() * 96, 32)
+      def warm_up_dots(self):
+          # the middle of the random color ranges, for both signs
+          self.xseed[:] = 0.0
+          self.color[0::2] = 207, 48, 48, 32
+          self.color[1::2] = 48, 48, 207, 32
+      def get_radius(self, dots):
+          radius = numpy.sin(6 * self.age[dots] + self.xseed[dots]) * 5.0 + 5.0
+          return radius, numpy.repeat(3.0, len(dots))
+      def get_color(self, dots):
+          return self.color[dots]
+      def update_speed(self, timediff):
+          self.xs = numpy.sin(6 * self.age + self.xseed * self.xdiff) * 20.0
+          self.ys = numpy.sin(6 * self.age + self.yseed) * 20.0
           
 if __name__ == "__main__":
   # TODO: broken since merging to game
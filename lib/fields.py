@@ -1,9 +1,9 @@
 from random import random
-import pygame, math
-import effects
+import pygame, math, numpy
 import actors
 from resources import Resources
 from lib.debug import dbg
+from lib.spatial import PositionIndex
 
 class MagicField:
       """
@@ -20,8 +20,14 @@ class MagicField:
       maxdist = 25
 
       def __init__(self):
-          self.particles = []
+          # ordered by position, particle params are kept in arrays of the same order
+          self.particles = PositionIndex()
           self.particle_count = 0
+          self.means  = numpy.zeros(0)
+          # 1 / (2 * dev ** 2)
+          self.spread = numpy.zeros(0)
+          # mult / (dev * sqrt(2 * pi))
+          self.scale  = numpy.zeros(0)
           self.rsc = Resources()
       def __str__(self):
           return self.__class__.__name__
@@ -29,81 +35,87 @@ class MagicField:
           return self.__str__()
 
       # could be overloaded
-      def value(self, pos):
-          v = self.particle_values(pos)
+      def values(self, positions):
+          """
+          Field values at an array of positions
+          """
+          v = self.particle_values(positions)
           return v
+      def value(self, pos):
+          return float(self.values((pos,))[0])
 
       # add a new normal distribution
       def add_particle(self, particle):
-          self.particles.append(particle)
+          i = self.particles.add(particle)
+          self.means  = numpy.insert(self.means, i, 0.0)
+          self.spread = numpy.insert(self.spread, i, 0.0)
+          self.scale  = numpy.insert(self.scale, i, 0.0)
           self.particle_count += 1
+          self.set_params(i, particle)
       def del_particle(self, particle):
-          self.particles.pop(self.particles.index(particle))
+          i = self.particles.remove(particle)
+          self.means  = numpy.delete(self.means, i)
+          self.spread = numpy.delete(self.spread, i)
+          self.scale  = numpy.delete(self.scale, i)
           self.particle_count -= 1 
+      def update_particle(self, particle):
+          """
+          Must be called when particle params change
+          """
+          self.particles.moved(particle)
+          self.set_params(self.particles.position(particle), particle)
+      def set_params(self, i, particle):
+          mean, dev, mult = particle.get_params()
+          self.means[i]  = mean
+          self.spread[i] = 1 / (2 * dev ** 2)
+          self.scale[i]  = mult / (dev * math.sqrt(2 * math.pi))
+
       # add all particles together
-      def particle_values(self, pos):
-          v = self.basevalue
+      def particle_values(self, positions):
+          positions = numpy.asarray(positions, dtype = float)
+          v = numpy.zeros(positions.shape) + self.basevalue
+          if self.particle_count == 0 or positions.size == 0:
+            return v
 
-          total = self.particle_count
-          if total > 0:
-            # find first particle
-            #dbg("Finding first particle")
-            first = middle = 0
-            last = total - 1
-            while last > first:
-              half = int(math.ceil(float(last - first) / 2))
-              middle = first + half
-              #dbg("first=%u i=%u last=%u" % (first, i, last))
-              if self.particles[middle].pos < pos - self.maxdist:
-                first += half
-              else:
-                last -= half
-          
-            # count all of them
-            edge = pos + self.maxdist
-            i = middle - 1
-            while i < total:
-              particle = self.particles[i]
-              if particle.pos > edge: break 
-              mean, dev, mult = particle.get_params()
-              value = 1 / (dev * math.sqrt(2 * math.pi)) * math.exp((-(pos - mean) ** 2)/(2 * dev ** 2)) * mult
-              v += value
-              i += 1
-          return v
+          # only the particles close enough to some of the positions
+          if positions.size == 1:
+            first = last = positions.item()
+          else:
+            first, last = positions.min(), positions.max()
+          lo, hi = self.particles.bounds(first - self.maxdist, last + self.maxdist)
+          if lo == hi:
+            return v
+          # rows for positions, columns for particles
+          diff   = positions[..., numpy.newaxis] - self.means[lo:hi]
+          values = numpy.exp(-diff * diff * self.spread[lo:hi]) * self.scale[lo:hi]
+          values = numpy.where(numpy.abs(diff) > self.maxdist, 0.0, values)
+          return v + values.sum(axis = -1)
 
       def update(self):
-          self.particles.sort(lambda x, y: cmp(x.pos, y.pos))
+          # particles move only a little each tick, repair the order and params
+          self.particles.repair()
+          params = numpy.array([particle.get_params() for particle in self.particles], dtype = float)
+          if len(params):
+            means, devs, mults = params.T
+            self.means  = means.copy()
+            self.spread = 1 / (2 * devs ** 2)
+            self.scale  = mults / (devs * math.sqrt(2 * math.pi))
 
       # Get the field's value at pos as translated through the camera view
       def draw(self, camera):
           # step should be float to cover the whole range
-          step = float(camera.sc_w()) / float(self.draw_real_points)
-          cur  = self.value(camera.sc2pl_x(0))
-          for i in xrange(self.draw_real_points):
-            i   += 1
-            pos  = i * step
-            next = self.value(camera.sc2pl_x(pos))
-            for j in xrange(self.interpolate):
-              value = cur + (next - cur) / self.interpolate * j
-              # draw
-              if abs(value) > 0.01:
-                # color of the line segment
-                alpha = min(192, abs(value) * 256 * 8)
-                color = self.color + (alpha,)
-                s = effects.get_circle(color, min(5, abs(value) * 100), camera.graphics, 3)
-                ypos = camera.sc_h() - (value + 1.0) * camera.sc_h() / 2.0
-                camera.graphics.blit(s, (pos - step + j * step / self.interpolate, ypos))
-
-            # draw debug
-            #if draw_debug and i % (self.draw_real_points / 5) == 0 and abs(cur) > 0.01:
-            #  at  = camera.sc2pl_x(pos)
-            #  txt = "%s.value(%.2f:%.2f) = %.2f" % (str(self), i, at, next)
-            #  txt = self.rsc.fonts.debugfont.render(txt, True, (255, 255, 255))
-            #  ypos = camera.sc_h() - (next + 1.0) * camera.sc_h() / 2.0
-            #  camera.graphics.blit(txt, (pos, ypos))
-
-            # next interpolation
-            cur = next
+          step   = float(camera.sc_w()) / float(self.draw_real_points)
+          # sample the real points in one go, interpolate between them
+          real   = numpy.arange(self.draw_real_points + 1) * step
+          values = self.values(camera.sc2pl_x(real))
+          xs     = numpy.arange(self.draw_real_points * self.interpolate) * (step / self.interpolate)
+          values = numpy.interp(xs, real, values)
+          ys     = camera.sc_h() - (values + 1.0) * camera.sc_h() / 2.0
+          # color of the line segments, nothing drawn where the field is weak
+          strength = numpy.abs(values)
+          alphas   = numpy.where(strength > 0.01, numpy.minimum(192, strength * 256 * 8), 0)
+          widths   = numpy.minimum(5, strength * 100)
+          camera.graphics.curve(xs, ys, widths, self.color, alphas)
 
 # Time
 # affects: speed < health regen? > vision
@@ -1,4 +1,4 @@
-import pygame
+import pygame, numpy, operator
 from pygame.locals import *
 from lib.debug import dbg
 from lib.settings import settings
@@ -15,12 +15,68 @@ except:
 class provider:
       screen_width = settings.screen_width
       screen_height = settings.screen_height
+      # rendered lines of text kept, all are dropped when full
+      text_cache_size = 256
       def __init__(self):
           pygame.display.set_caption(settings.game_name)
           dbg("Initializing graphics %ux%u fullscreen=%s" % \
               (settings.screen_width, settings.screen_height, settings.fullscreen))
+          # (font, text, color) -> image
+          self.text_cache = {}
+      def begin_static(self, key):
+          """
+          Start drawing the static layer (sky, scenery) for key, returns
+          False if the provider still has it from an earlier frame and
+          it need not be drawn
+
+          The key must change whenever anything in the layer does.
+          """
+          self.clear()
+          return True
+      def end_static(self):
+          pass
+      def surface(self, img):
+          """
+          The pygame surface an image was made from, only images made
+          with keep set have it
+          """
+          return img
+      def text(self, font, txt, coords, color):
+          """
+          Draw a line of text, lines drawn before are not rendered again
+          """
+          key = (font, txt, color)
+          img = self.text_cache.get(key)
+          if img is None:
+            if len(self.text_cache) >= self.text_cache_size:
+              self.text_cache = {}
+            img = self.text_cache[key] = font.render(txt, True, color)
+          self.blit(img, coords)
       def center_blit(self, img, x, y):
           self.blit(img, (settings.screen_width / 2 - img.get_width() / 2 + x, y))
+      def blits(self, seq):
+          """
+          Blit a sequence of (image, coords)
+          """
+          for img, coords in seq:
+            self.blit(img, coords)
+      def curve(self, xs, ys, widths, color, alphas):
+          """
+          Draw a curve through the points as a row of blurred dots, the
+          dot at x, y has a radius of width and its own alpha
+
+          The dots come from the circle cache, looked up with the alpha
+          already rounded, and the whole row goes to blits() at once.
+          """
+          from lib.effects import round_color, cached_circle
+          radii = widths.astype(int)
+          # alpha in the steps of the circle cache
+          steps = numpy.minimum((alphas / 8.0 + 0.5).astype(int) * 8, 255)
+          drawn = numpy.flatnonzero((steps > 0) & (radii > 0))
+          rgb   = round_color(color[:3])
+          self.blits([(cached_circle(rgb + (a,), r, 3, self), (x, y))
+                      for r, a, x, y in zip(radii[drawn].tolist(), steps[drawn].tolist(),
+                                            xs[drawn].tolist(), ys[drawn].tolist())])
 
 class nographics_provider(provider):
       def __init__(self, *args, **kwargs):
@@ -29,9 +85,9 @@ class nographics_provider(provider):
           self.screen = None
 
       Font = pygame.font.Font
-      def image(self, img): return img
+      def image(self, img, keep = False): return img
       def dummy(self, *args, **kwargs): pass
-      clear = update = fill = rect = blit = dummy
+      clear = update = fill = rect = blit = blits = curve = text = end_static = dummy
       
 class pygame_provider(provider):
       def __init__(self, *args, **kwargs):
@@ -44,7 +100,7 @@ class pygame_provider(provider):
 
       Font = pygame.font.Font
 
-      def image(self, img):
+      def image(self, img, keep = False):
           return img
       
       def clear(self):
@@ -55,6 +111,9 @@ class pygame_provider(provider):
       
       def blit(self, img, coords):
           self.screen.blit(img, coords)
+
+      def blits(self, seq):
+          self.screen.blits(seq, False)
       
       def rect(self, color, rect, fill):
           if fill: width = 0
@@ -69,6 +128,179 @@ class pygame_provider(provider):
       def line(self, start, end, color, width = 1):
           pygame.drawline(self.screen, start, end, color, width)
       
+class atlas:
+      """
+      One large texture shared by many small images
+
+      Images are packed in shelves (rows of equal height). The room of a
+      freed image is reused by the next image that fits in it, a shelf is
+      emptied once every image placed on it has been freed.
+      """
+      # images larger than this get a texture of their own
+      max_image = 512
+      def __init__(self, size):
+          self.size    = size
+          self.texture = glGenTextures(1)
+          glBindTexture(GL_TEXTURE_2D, self.texture)
+          glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+          glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+          glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, size, size, 0, GL_RGBA, GL_UNSIGNED_BYTE, None)
+          # each shelf is [y, height, next free x, images on it, freed [x, w]]
+          self.shelves = []
+          self.top     = 0
+          self.images  = 0
+
+      def alloc(self, w, h):
+          """
+          Find room for a w x h image, returns (shelf, x, y, w) or None if full
+          """
+          # one pixel of padding keeps neighbours from bleeding in
+          w += 1
+          h += 1
+          for shelf in self.shelves:
+            if shelf[1] >= h and shelf[1] <= h * 2:
+              for gap in shelf[4]:
+                if gap[1] >= w:
+                  x = gap[0]
+                  gap[0] += w
+                  gap[1] -= w
+                  if not gap[1]:
+                    shelf[4].remove(gap)
+                  shelf[3] += 1
+                  self.images += 1
+                  return shelf, x, shelf[0], w
+          best = None
+          for shelf in self.shelves:
+            if shelf[1] >= h and shelf[2] + w <= self.size:
+              if not best or shelf[1] < best[1]:
+                best = shelf
+          # open a new shelf rather than waste a much taller one
+          if (not best or best[1] > h * 2) and self.top + h <= self.size:
+            best = [self.top, h, 0, 0, []]
+            self.top += h
+            self.shelves.append(best)
+          if not best:
+            return None
+          x = best[2]
+          best[2] += w
+          best[3] += 1
+          self.images += 1
+          return best, x, best[0], w
+
+      def free(self, shelf, x, w):
+          shelf[3] -= 1
+          self.images -= 1
+          if shelf[3] == 0:
+            shelf[2] = 0
+            shelf[4] = []
+          elif x + w == shelf[2]:
+            shelf[2] = x
+          else:
+            shelf[4].append([x, w])
+
+atlases = []
+def atlas_alloc(w, h):
+    """
+    Reserve room for an image in the shared atlases, returns
+    (atlas, shelf, x, y) or None if the image is too large
+    """
+    if w > atlas.max_image or h > atlas.max_image:
+      return None
+    for book in atlases:
+      slot = book.alloc(w, h)
+      if slot:
+        return (book,) + slot
+    book = atlas(min(2048, glGetIntegerv(GL_MAX_TEXTURE_SIZE)))
+    atlases.append(book)
+    return (book,) + book.alloc(w, h)
+
+def release_atlases():
+    """
+    Delete the textures of atlases left without images, the first one
+    is kept for the images to come
+    """
+    for book in atlases[1:]:
+      if not book.images:
+        atlases.remove(book)
+        glDeleteTextures(book.texture)
+
+def atlas_stats():
+    return "ATLASES: %u (%uKB) images=%u" % \
+           (len(atlases), sum([book.size * book.size * 4 for book in atlases]) / 1024,
+            sum([book.images for book in atlases]))
+
+class dirty_pygame_provider(pygame_provider):
+      """
+      Keeps the static layer in a surface of its own, each frame only
+      the areas drawn over in the last frame are restored from it and
+      only the areas drawn in either frame are updated on screen
+      """
+      def __init__(self, *args, **kwargs):
+          pygame_provider.__init__(self, *args, **kwargs)
+          dbg("Using dirty rectangles")
+          self.background = self.screen.copy()
+          self.static_key = None
+          # where drawing goes, the screen or the static layer
+          self.target     = self.screen
+          self.drawn      = []
+          self.last_drawn = []
+          # update the whole screen on next update()
+          self.full       = True
+
+      def clear(self):
+          self.screen.fill((0, 0, 0, 255))
+          self.static_key = None
+          self.full = True
+
+      def begin_static(self, key):
+          self.drawn = []
+          if key == self.static_key:
+            return False
+          self.static_key = key
+          self.target = self.background
+          return True
+      def end_static(self):
+          if self.target is self.background:
+            self.target = self.screen
+            self.screen.blit(self.background, (0, 0))
+            self.full = True
+          else:
+            for rect in self.last_drawn:
+              self.screen.blit(self.background, rect, rect)
+
+      def update(self):
+          if self.full:
+            pygame.display.flip()
+            self.full = False
+          else:
+            pygame.display.update(self.last_drawn + self.drawn)
+          self.last_drawn = self.drawn
+          self.drawn = []
+
+      def drew(self, rect):
+          if self.target is self.screen:
+            self.drawn.append(rect)
+
+      def blit(self, img, coords):
+          self.drew(self.target.blit(img, coords))
+
+      def blits(self, seq):
+          for rect in self.target.blits(seq):
+            self.drew(rect)
+
+      def rect(self, color, rect, fill):
+          if fill: width = 0
+          else: width = 1
+          self.drew(pygame.draw.rect(self.target, color, rect, width))
+
+      def fill(self, color, rect = None):
+          if rect:
+            self.drew(self.target.fill(color, rect))
+          else:
+            self.drew(self.target.fill(color))
+      def line(self, start, end, color, width = 1):
+          self.drew(pygame.draw.line(self.target, color, start, end, width))
+
 class opengl_provider(provider):
       def __init__(self, *args, **kwargs):
           provider.__init__(self, *args, **kwargs)
@@ -88,71 +320,193 @@ class opengl_provider(provider):
           glEnable(GL_TEXTURE_2D)
           glEnable(GL_BLEND)
           glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
+          glEnableClientState(GL_VERTEX_ARRAY)
+          glEnableClientState(GL_TEXTURE_COORD_ARRAY)
+
+          # quads blitted since the last flush, all from batch_texture
+          self.batch_texture = None
+          self.batch_verts   = []
+          self.batch_coords  = []
+          self.draw_calls    = 0
 
       class Font(pygame.font.Font):
+            """
+            Glyphs are rendered one at a time into the atlases, a line of
+            text is drawn as a row of glyph quads
+            """
+            # line layouts kept, all are dropped when full
+            max_lines = 256
+            def __init__(self, *args, **kwargs):
+                pygame.font.Font.__init__(self, *args, **kwargs)
+                # (char, color) -> image
+                self.glyphs = {}
+                # (text, color) -> quads of the line, see layout()
+                self.lines  = {}
+
             def render(self, txt, antialias, color):
                 img = pygame.font.Font.render(self, txt, antialias, color)
-                return opengl_provider.image(img)
+                # text is short lived, keep it out of the atlases
+                return opengl_provider.image(img, pack = False)
+
+            def glyph(self, char, color):
+                key = (char, color)
+                if not self.glyphs.has_key(key):
+                  img = pygame.font.Font.render(self, char, True, color)
+                  self.glyphs[key] = opengl_provider.image(img)
+                return self.glyphs[key]
+
+            def layout(self, txt, color):
+                """
+                Quads of a line relative to its top left corner, as runs of
+                (texture, vertices, texcoords), without kerning
+                """
+                key = (txt, color)
+                if not self.lines.has_key(key):
+                  if len(self.lines) >= self.max_lines:
+                    self.lines = {}
+                  runs = []
+                  x = 0
+                  for char, metrics in zip(txt, self.metrics(txt)):
+                    # no glyph in the font
+                    if metrics is None:
+                      continue
+                    if not char.isspace():
+                      img = self.glyph(char, color)
+                      if not runs or runs[-1][0] != img.texture:
+                        runs.append((img.texture, [], []))
+                      x2, y2 = x + img.width, img.height
+                      runs[-1][1].extend((x, 0, x, y2, x2, y2, x2, 0))
+                      runs[-1][2].extend(img.texcoords)
+                    x += metrics[4]
+                  self.lines[key] = runs
+                return self.lines[key]
                
       class image:
-            def __init__(self, img):
-                # create texture
+            def __init__(self, img, pack = True, keep = False):
                 w, h = img.get_width(), img.get_height()
                 self.width  = w
                 self.height = h
-      
-                texdata = pygame.image.tostring(img, "RGBA", 1)
-                tex = glGenTextures(1)
-                self.__texture = tex
-                glBindTexture(GL_TEXTURE_2D, tex)
-                glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
-                glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
-                glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, w, h, 0, GL_RGBA, GL_UNSIGNED_BYTE, texdata)
-          
-                # create genlist
-                genlist = glGenLists(1)
-                glNewList(genlist, GL_COMPILE)
-                glBindTexture(GL_TEXTURE_2D, tex)
-                glBegin(GL_QUADS)
-                glTexCoord2f(0, 1); glVertex2f(0, 0)
-                glTexCoord2f(0, 0); glVertex2f(0, h)
-                glTexCoord2f(1, 0); glVertex2f(w, h)
-                glTexCoord2f(1, 1); glVertex2f(w, 0)
-                glEnd()
-                glEndList()
-                self.genlist = genlist
+                # for compositing images together, see surface()
+                self.surface = keep and img or None
+
+                texdata = pygame.image.tostring(img, "RGBA", 0)
+                self.slot = pack and atlas_alloc(w, h) or None
+                if self.slot:
+                  book, shelf, x, y, padded = self.slot
+                  glBindTexture(GL_TEXTURE_2D, book.texture)
+                  glTexSubImage2D(GL_TEXTURE_2D, 0, x, y, w, h, GL_RGBA, GL_UNSIGNED_BYTE, texdata)
+                  self.texture = book.texture
+                  size = float(book.size)
+                  u1, v1, u2, v2 = x / size, y / size, (x + w) / size, (y + h) / size
+                else:
+                  tex = glGenTextures(1)
+                  glBindTexture(GL_TEXTURE_2D, tex)
+                  glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+                  glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+                  glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, w, h, 0, GL_RGBA, GL_UNSIGNED_BYTE, texdata)
+                  self.texture = tex
+                  u1, v1, u2, v2 = 0.0, 0.0, 1.0, 1.0
+                # same corner order as the vertices in blit()
+                self.texcoords = (u1, v1, u1, v2, u2, v2, u2, v1)
 
             def __del__(self):
                 try:
-                  glDeleteTextures(self.__texture)
+                  if self.slot:
+                    book, shelf, x, y, padded = self.slot
+                    book.free(shelf, x, padded)
+                  else:
+                    glDeleteTextures(self.texture)
                 except AttributeError:
                   pass
                 except TypeError:
                   pass
-                try:
-                  glDeleteLists(self.genlist, 1)
-                except TypeError:
-                  pass
       
             def get_width(self):
                 return self.width
             def get_height(self):
                 return self.height
 
+      def surface(self, img):
+          return img.surface
+
+      def flush(self):
+          """
+          Draw the quads batched so far in one call
+          """
+          if not self.batch_verts:
+            return
+          verts  = numpy.array(self.batch_verts, numpy.float32)
+          coords = numpy.array(self.batch_coords, numpy.float32)
+          glLoadIdentity()
+          glBindTexture(GL_TEXTURE_2D, self.batch_texture)
+          glVertexPointer(2, GL_FLOAT, 0, verts)
+          glTexCoordPointer(2, GL_FLOAT, 0, coords)
+          glDrawArrays(GL_QUADS, 0, len(verts) / 2)
+          self.draw_calls += 1
+          self.batch_verts  = []
+          self.batch_coords = []
+
       def clear(self):
+          self.batch_verts  = []
+          self.batch_coords = []
+          self.draw_calls   = 0
+          # nothing is batched yet, so no texture is in use
+          release_atlases()
           glClear(GL_COLOR_BUFFER_BIT|GL_DEPTH_BUFFER_BIT)
           glLoadIdentity() 
 
       def update(self):
+          self.flush()
           glFlush()
           pygame.display.flip()
 
       def blit(self, img, coords):
+          # quads are drawn in the order they were blitted, so the batch only
+          # has to be split when the texture changes
+          if img.texture != self.batch_texture:
+            self.flush()
+            self.batch_texture = img.texture
+          x, y = coords
+          x2 = x + img.width
+          y2 = y + img.height
+          self.batch_verts.extend((x, y, x, y2, x2, y2, x2, y))
+          self.batch_coords.extend(img.texcoords)
+
+      def text(self, font, txt, coords, color):
+          # glyphs share the atlases with the sprites, so text usually
+          # goes in the same batch
+          for texture, verts, texcoords in font.layout(txt, color):
+            if texture != self.batch_texture:
+              self.flush()
+              self.batch_texture = texture
+            self.batch_verts.extend(map(operator.add, verts, coords * (len(verts) / 2)))
+            self.batch_coords.extend(texcoords)
+
+      def curve(self, xs, ys, widths, color, alphas):
+          # one triangle strip along the dots the other providers would draw
+          self.flush()
+          count  = len(xs)
+          verts  = numpy.empty((count, 2, 2), numpy.float32)
+          verts[:, 0, 0] = verts[:, 1, 0] = xs + widths
+          verts[:, 0, 1] = ys
+          verts[:, 1, 1] = ys + 2 * widths
+          colors = numpy.empty((count, 2, 4), numpy.float32)
+          colors[..., :3] = numpy.array(color[:3]) / 255.0
+          colors[..., 3]  = (alphas / 255.0)[:, numpy.newaxis]
           glLoadIdentity()
-          glTranslate(coords[0], coords[1], 0)
-          glCallList(img.genlist)
+          glBindTexture(GL_TEXTURE_2D, 0)
+          glDisableClientState(GL_TEXTURE_COORD_ARRAY)
+          glEnableClientState(GL_COLOR_ARRAY)
+          glVertexPointer(2, GL_FLOAT, 0, verts)
+          glColorPointer(4, GL_FLOAT, 0, colors)
+          glDrawArrays(GL_TRIANGLE_STRIP, 0, count * 2)
+          glDisableClientState(GL_COLOR_ARRAY)
+          glEnableClientState(GL_TEXTURE_COORD_ARRAY)
+          glColor4f(1.0, 1.0, 1.0, 1.0)
+          self.draw_calls += 1
 
       def rect(self, color, rect, fill):
+          self.flush()
           glLoadIdentity()
           glBindTexture(GL_TEXTURE_2D, 0)
           glColor3f(color[0]/255, color[1]/255, color[2]/255)
@@ -168,6 +522,7 @@ class opengl_provider(provider):
           glColor4f(1.0, 1.0, 1.0, 1.0)
 
       def fill(self, color, rect = None):
+          self.flush()
           if rect is None:
             rect = (0, 0, settings.screen_width, settings.screen_height)
           glLoadIdentity()
@@ -182,6 +537,7 @@ class opengl_provider(provider):
           glColor4f(1.0, 1.0, 1.0, 1.0)
 
       def line(self, start, end, color, width = 1):
+          self.flush()
           glLoadIdentity()
           glColor3f(color[0]/255, color[1]/255, color[2]/255)
           glBindTexture(GL_TEXTURE_2D, 0)
@@ -202,5 +558,7 @@ def default_provider():
         return pygame_provider()
     elif requested == "none":
       return nographics_provider()
+    elif settings.dirty_rects:
+      return dirty_pygame_provider()
     else:
       return pygame_provider()
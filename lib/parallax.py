@@ -0,0 +1,217 @@
+import math, pygame, numpy
+from lib import actors
+
+def composite(dest, src, x, y):
+    """
+    Draw src over dest at x, y keeping the alpha of both
+    """
+    rect = pygame.Rect(x, y, src.get_width(), src.get_height()).clip(dest.get_rect())
+    if not rect.width or not rect.height:
+      return
+    dest_a = pygame.surfarray.pixels_alpha(dest)[rect.left:rect.right, rect.top:rect.bottom]
+    # nothing there yet (all zeros), a plain copy will do
+    if not dest_a.any():
+      del dest_a
+      dest.blit(src, (x, y), special_flags = pygame.BLEND_RGBA_MAX)
+      return
+    sx, sy = rect.x - x, rect.y - y
+    # surfarray is indexed [x][y]
+    src_rgb = pygame.surfarray.array3d(src)[sx:sx + rect.width, sy:sy + rect.height] / 255.0
+    src_a   = pygame.surfarray.array_alpha(src)[sx:sx + rect.width, sy:sy + rect.height, numpy.newaxis] / 255.0
+    dest_rgb = pygame.surfarray.pixels3d(dest)[rect.left:rect.right, rect.top:rect.bottom]
+    below    = dest_a[..., numpy.newaxis] / 255.0 * (1.0 - src_a)
+    out_a    = src_a + below
+    out_rgb  = (src_rgb * src_a + dest_rgb / 255.0 * below) / numpy.maximum(out_a, 1e-6)
+    dest_rgb[...] = numpy.rint(out_rgb * 255.0)
+    dest_a[...]   = numpy.rint(out_a[..., 0] * 255.0)
+
+class Layer:
+      """
+      Objects of one stacking and distance, drawn once into cached strips
+      that are blitted with the camera offset each frame
+      """
+      # drawn with the actors, looks the same while the camera stays put
+      static   = True
+      debug_me = False
+
+      def __init__(self, world, stacking, distance):
+          self.world    = world
+          self.stacking = stacking
+          self.distance = distance
+          self.objects  = []
+          # rebuilt when objects are added or the camera scale changes
+          self.strips   = None
+          self.scale    = None
+          # changes with the objects, for the static layer key
+          self.version  = 0
+
+      def add(self, obj):
+          self.objects.append(obj)
+          self.strips = None
+          self.version += 1
+
+      def origin(self):
+          """
+          Screen x of the layer's position 0
+          """
+          return self.world.camera.pl2sc_x(0) / self.distance
+
+      def new_strip(self, width, height):
+          return pygame.surface.Surface((width, height), pygame.SRCALPHA, 32)
+
+      def image(self, strip):
+          graphics = self.world.camera.graphics
+          if graphics.screen:
+            strip = strip.convert_alpha(graphics.screen)
+          return graphics.image(strip)
+
+      def prepare(self):
+          cam = self.world.camera
+          if self.strips is None or self.scale != cam.mult_x:
+            self.scale  = cam.mult_x
+            self.strips = self.build()
+
+      def draw(self):
+          cam = self.world.camera
+          self.prepare()
+          drawn = False
+          # whole pixels, pygame would truncate each strip on its own and
+          # leave seams between them
+          origin = int(math.floor(self.origin()))
+          for img, x, y in self.visible(origin):
+            cam.graphics.blit(img, (x, y))
+            drawn = True
+          return drawn
+
+class TileLayer(Layer):
+      """
+      A background image repeated over the whole width, the strip holds
+      enough copies to cover the screen at any offset
+      """
+      def build(self):
+          cam      = self.world.camera
+          graphics = cam.graphics
+          strips   = []
+          for obj in self.objects:
+            tile  = graphics.surface(obj.img_list[0])
+            bg_w  = tile.get_width()
+            bg_h  = tile.get_height()
+            count = int(cam.sc_w() / bg_w) + 2
+            strip = self.new_strip(bg_w * count, bg_h)
+            for i in xrange(count):
+              composite(strip, tile, i * bg_w, 0)
+            strips.append((self.image(strip), bg_w, cam.sc_h() - bg_h))
+          return strips
+
+      def visible(self, origin):
+          for img, bg_w, y in self.strips:
+            yield img, origin % bg_w - bg_w, y
+
+class SpriteLayer(Layer):
+      """
+      Separate objects (sun, clouds) at their positions, split into strips
+      of strip_width so that no single image gets too large
+
+      Hovering objects keep their own images so that they can wobble.
+      """
+      strip_width = 1024
+      top         = 0
+      # (image, x, average y, object) of the hovering objects
+      hovering    = []
+
+      def build(self):
+          cam      = self.world.camera
+          graphics = cam.graphics
+          # object images and their places relative to the origin
+          placed   = []
+          hovering = []
+          for obj in self.objects:
+            img = graphics.surface(obj.img_list[0])
+            x   = obj.pos / (cam.mult_x * self.distance) - obj.img_w / 2
+            y   = cam.pl2sc_y(obj.ypos) / self.distance + obj.hover_height + obj.base_height
+            if not obj.from_ceiling:
+              y = cam.sc_h() - obj.img_h - y
+            if obj.hover_height:
+              hovering.append((self.image(img), int(x), int(y), obj))
+            else:
+              placed.append((img, int(x), int(y)))
+          self.hovering = hovering
+          # wobbling changes the picture every frame
+          self.static   = not hovering
+          if not placed:
+            return {}
+          top    = min([y for img, x, y in placed])
+          bottom = max([y + img.get_height() for img, x, y in placed])
+          strips = {}
+          for img, x, y in placed:
+            first = int(math.floor(float(x) / self.strip_width))
+            last  = int(math.floor(float(x + img.get_width() - 1) / self.strip_width))
+            for i in xrange(first, last + 1):
+              if not strips.has_key(i):
+                strips[i] = self.new_strip(self.strip_width, bottom - top)
+              composite(strips[i], img, x - i * self.strip_width, y - top)
+          self.top = top
+          for i, strip in strips.items():
+            strips[i] = self.image(strip)
+          return strips
+
+      def visible(self, origin):
+          width = self.world.camera.sc_w()
+          first = int(math.floor(-origin / self.strip_width))
+          last  = int(math.floor((width - origin) / self.strip_width))
+          for i in xrange(first, last + 1):
+            if self.strips.has_key(i):
+              yield self.strips[i], origin + i * self.strip_width, self.top
+          for img, x, y, obj in self.hovering:
+            if origin + x + img.get_width() > 0 and origin + x < width:
+              if obj.from_ceiling:
+                yield img, origin + x, y + int(round(obj.wobble()))
+              else:
+                yield img, origin + x, y - int(round(obj.wobble()))
+
+class Parallax:
+      """
+      Background and sky objects grouped in layers, they do not take part
+      in updates and are drawn in stacking order among the actors
+      """
+      def __init__(self, world):
+          self.world  = world
+          # sorted by stacking
+          self.layers = []
+          # (layer class, stacking, distance) -> layer
+          self.by_key = {}
+
+      def add(self, obj):
+          if isinstance(obj, actors.Background):
+            kind = TileLayer
+          else:
+            kind = SpriteLayer
+          key = (kind, obj.stacking, obj.distance)
+          if not self.by_key.has_key(key):
+            self.by_key[key] = kind(self.world, obj.stacking, obj.distance)
+            self.layers.append(self.by_key[key])
+            self.layers.sort(key = lambda layer: layer.stacking)
+          self.by_key[key].add(obj)
+
+      def prepare(self):
+          """
+          Build the layers before they are needed
+          """
+          for layer in self.layers:
+            layer.prepare()
+
+      def merge(self, drawables):
+          """
+          Layers mixed into drawables (sorted by stacking), each layer goes
+          before the drawables with the same stacking
+          """
+          merged = []
+          layers = self.layers
+          i = 0
+          for obj in drawables:
+            while i < len(layers) and layers[i].stacking <= obj.stacking:
+              merged.append(layers[i])
+              i += 1
+            merged.append(obj)
+          merged.extend(layers[i:])
+          return merged
@@ -0,0 +1,64 @@
+import bisect
+
+class Perception:
+      """
+      What controllers see of the world during one tick
+
+      Built on first use in a tick and shared by every controller, so that
+      the same range queries are not repeated for each of them. Positions
+      are as they were when first asked for, actors created or destroyed
+      later in the tick are added or removed by the world.
+
+      Fields are not part of the snapshot, goals read them live. Sampling
+      them into a grid was slower: the planners look at different places
+      and a moving ball changes the field there by the next look.
+      """
+      def __init__(self, world):
+          self.world = world
+          self.time  = world.get_time()
+          # class tuple -> (sorted positions, actors in the same order)
+          self.groups = {}
+
+      def group(self, classes):
+          key = tuple(classes)
+          if not self.groups.has_key(key):
+            members = self.world.get_actors(include = classes)
+            members.sort(key = lambda actor: actor.pos)
+            self.groups[key] = ([actor.pos for actor in members], members)
+          return self.groups[key]
+
+      def add(self, actor):
+          """
+          Put a new actor into the groups it belongs to
+          """
+          bases = self.world.get_bases(actor.__class__)
+          for key, (positions, members) in self.groups.items():
+            for klass in key:
+              if klass in bases:
+                i = bisect.bisect_right(positions, actor.pos)
+                positions.insert(i, actor.pos)
+                members.insert(i, actor)
+                break
+      def remove(self, actor):
+          for positions, members in self.groups.values():
+            if actor in members:
+              i = members.index(actor)
+              del positions[i]
+              del members[i]
+
+      def actors(self, x1, x2, include):
+          """
+          Actors of the included classes with position in [x1 : x2], in
+          order of position
+          """
+          positions, members = self.group(include)
+          lo = bisect.bisect_left(positions, x1)
+          hi = bisect.bisect_right(positions, x2)
+          return members[lo:hi]
+
+      def balls(self, x1, x2, field):
+          """
+          Magic balls affecting field with position in [x1 : x2]
+          """
+          from lib.actors.magicballs import field2ball
+          return self.actors(x1, x2, [field2ball(field)])
@@ -107,7 +107,8 @@ class Resources:
             img = self.scale(img, resize)
           # TODO: does this help at all?
           #img = img.convert_alpha(self.screen)
-          img = self.graphics.image(img)
+          # parallax layers composite sprites, see provider.surface()
+          img = self.graphics.image(img, keep = True)
           self.sprites[listname].append(img)
           return img
 
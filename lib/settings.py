@@ -6,7 +6,8 @@ class Settings:
                    graphics_provider = "opengl", fullscreen = True,
                    screen_width = 1280, screen_height = 768,
                    target_fps = 45.0, game_speed = 1.0,
-                   debug = False)
+                   debug = False, headless = False, seed = None,
+                   dirty_rects = False, control_budget = 5.0)
 
       def set(self, **kwargs):
           self.s.update(kwargs)
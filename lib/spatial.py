@@ -0,0 +1,105 @@
+import bisect
+
+class PositionIndex:
+      """
+      Objects kept in order of their pos attribute
+
+      Positions only change a little between ticks, so the order is repaired
+      with an insertion sort pass (close to O(n) when nothing crosses) and
+      range queries are answered by bisecting the cached keys.
+      """
+      def __init__(self):
+          self.items  = []
+          self.keys   = []
+          # position of each object at the time it was last indexed
+          self.key_of = {}
+          # largest distance any object has moved away from its key
+          self.drift  = 0.0
+
+      def __len__(self):
+          return len(self.items)
+      def __iter__(self):
+          return iter(self.items)
+
+      def add(self, item):
+          """
+          Insert item in order, returns its place
+          """
+          key = item.pos
+          i = bisect.bisect_right(self.keys, key)
+          self.keys.insert(i, key)
+          self.items.insert(i, item)
+          self.key_of[item] = key
+          return i
+      def remove(self, item):
+          """
+          Remove item, returns the place it had
+          """
+          i = self.items.index(item)
+          self.items.pop(i)
+          self.keys.pop(i)
+          del self.key_of[item]
+          return i
+      def moved(self, item):
+          """
+          Must be called after item.pos changes, keeps range queries exact
+          until the next repair()
+          """
+          drift = abs(item.pos - self.key_of[item])
+          if drift > self.drift:
+            self.drift = drift
+
+      def repair(self):
+          """
+          Re-sort by current positions and refresh the keys
+          """
+          items = self.items
+          keys  = [item.pos for item in items]
+          for i in xrange(1, len(keys)):
+            key = keys[i]
+            if key < keys[i - 1]:
+              item = items[i]
+              j = i - 1
+              while j >= 0 and keys[j] > key:
+                keys[j + 1]  = keys[j]
+                items[j + 1] = items[j]
+                j -= 1
+              keys[j + 1]  = key
+              items[j + 1] = item
+          self.keys   = keys
+          self.key_of = dict(zip(items, keys))
+          self.drift  = 0.0
+
+      def position(self, item):
+          """
+          Current place of item in the ordering
+          """
+          i = bisect.bisect_left(self.keys, self.key_of[item])
+          while self.items[i] is not item:
+            i += 1
+          return i
+      def bounds(self, x1 = None, x2 = None):
+          """
+          Slice [lo : hi] of the ordering that holds all objects with position
+          in [x1 : x2], None meaning unbounded. May hold a few extra objects
+          if they have moved since last repair.
+          """
+          if x1 is None:
+            lo = 0
+          else:
+            lo = bisect.bisect_left(self.keys, x1 - self.drift)
+          if x2 is None:
+            hi = len(self.keys)
+          else:
+            hi = bisect.bisect_right(self.keys, x2 + self.drift)
+          return lo, hi
+      def range(self, x1 = None, x2 = None):
+          """
+          Objects with position in [x1 : x2], None meaning unbounded
+          """
+          lo, hi = self.bounds(x1, x2)
+          items = self.items[lo:hi]
+          if self.drift:
+            items = [item for item in items
+                     if (x1 is None or item.pos >= x1) and (x2 is None or item.pos <= x2)]
+          return items
@@ -1,4 +1,3 @@
-from random import random
 
 from lib import fields, actors
 from lib.debug import dbg
@@ -89,7 +88,7 @@ class Story:
           world.new_actor(actors.ForegroundOldGrass, 0)
           # paint some scenery
           for i in xrange(10):
-            world.new_actor(actors.Tree, -250 + (500 / 10) * i + random() * 25)
+            world.new_actor(actors.Tree, -250 + (500 / 10) * i + self.world.random() * 25)
           for i in xrange(3):
             world.new_actor(actors.Sun, -1200 + (2500 / 3) * i)
           for i in xrange(6):
@@ -97,11 +96,11 @@ class Story:
 
           # some ambient lifeforms
           for i in xrange(25):
-            bird = world.new_actor(actors.FlockingBird, random() * 1000 - 500)
-            bird.ypos = random() * bird.controller.ypos_upper_bound
+            bird = world.new_actor(actors.FlockingBird, self.world.random() * 1000 - 500)
+            bird.ypos = self.world.random() * bird.controller.ypos_upper_bound
           for i in xrange(2):
-            bird = world.new_actor(actors.PredatorBird, random() * 1000 - 500)
-            bird.ypos = random() * 10.0
+            bird = world.new_actor(actors.PredatorBird, self.world.random() * 1000 - 500)
+            bird.ypos = self.world.random() * 10.0
 
           # set music
           self.rsc.set_music(self.themesong)
@@ -117,12 +116,10 @@ class Story:
           else:
             self.queue.append(id)
           now = self.world.get_time()
-          # render
-          img = self.rsc.fonts.textfont.render(text, True, (255, 255, 255))
-          # add to narrations list
+          # add to narrations list, drawn as text each frame
           self.narrations.append({ "showtime": now + showtime,
                                    "cleartime": now + showtime + duration,
-                                   "img": img,
+                                   "text": text,
                                    "id": id,
                                  })
 
@@ -187,6 +184,7 @@ class Story:
                     cam.sc_h() / 2 - self.game_over_img.get_height() / 2 - 100))
 
           # proccess narratives
+          font = self.rsc.fonts.textfont
           draw_list = []
           extra_offset = 0
           i = 0
@@ -203,10 +201,10 @@ class Story:
                   self.narrations.pop(i)
                 else:
                   part = (cleartime + 1.0 - now)
-                  extra_offset += int(part * (narr["img"].get_height() + 5))
+                  extra_offset += int(part * (font.get_height() + 5))
                   i += 1
               else:
-                draw_list.append(narr["img"])
+                draw_list.append(narr["text"])
                 i += 1
             else:
               i += 1
@@ -216,6 +214,6 @@ class Story:
 
           # draw them
           line_y = 10 + extra_offset
-          for img in draw_list:
-            g.blit(img, (10, line_y))
-            line_y += img.get_height() + 5
+          for text in draw_list:
+            g.text(font, text, (10, line_y), (255, 255, 255))
+            line_y += font.get_height() + 5
@@ -1,6 +1,5 @@
 from lib import actors
 from lib.stories import Story, storybook
-from random import random
 
 class Shepherd(Story):
       story_title = "Gentle Shepherd"
@@ -18,7 +17,7 @@ class Shepherd(Story):
           # add some rabbits to guide
           self.totalrabbits = 15
           for i in xrange(self.totalrabbits):
-            rabbit = world.new_actor(actors.ScaredRabbit, -25.0 + 50 * random())
+            rabbit = world.new_actor(actors.ScaredRabbit, -25.0 + 50 * self.world.random())
             rabbit.controller.set_waypoint(0.0)
 
           # player-controlled object
@@ -206,7 +205,7 @@ class Massacre(Story):
 
           # sweet rabbits to protect
           for i in xrange(25):
-            rabbit = world.new_actor(actors.ScaredRabbit, 0 + 100 * random())
+            rabbit = world.new_actor(actors.ScaredRabbit, 0 + 100 * self.world.random())
             rabbit.controller.set_waypoint(50.0)
 
           # player-controlled object
@@ -428,7 +427,7 @@ class Blockade(Story):
             if self.time_passed(60):
               dragons = len(self.world.get_actors(include = [actors.Dragon]))
               if dragons < 2:
-                dragon = self.world.new_actor(actors.HuntingDragon, self.dude.pos - 75 + random() * 10)
+                dragon = self.world.new_actor(actors.HuntingDragon, self.dude.pos - 75 + self.world.random() * 10)
                 dragon.controller.set_waypoint(200.0)
 storybook.add(Blockade)
 
@@ -444,13 +443,13 @@ class Siege(Story):
 
           # enemies
           for i in xrange(5):
-            dragon = world.new_actor(actors.HuntingDragon, random() * 75.0)
+            dragon = world.new_actor(actors.HuntingDragon, self.world.random() * 75.0)
             dragon.controller.set_waypoint(50)
 
           # friends
           self.guardpost = []
           for i in xrange(4):
-            villager = world.new_actor(actors.HuntingVillager,  150 - random() * 75.0)
+            villager = world.new_actor(actors.HuntingVillager,  150 - self.world.random() * 75.0)
             villager.controller.set_waypoint(50)
             self.guardpost.append(villager)
 
@@ -485,7 +484,7 @@ class Siege(Story):
               self.set_state("dude-death")
               self.set_result(False)
             elif story_time > 120.0 and self.time_passed(30.0, "respawn") and dragons < 5:
-              pos = min(self.dude.pos - 75, -50) - random() * 25
+              pos = min(self.dude.pos - 75, -50) - self.world.random() * 25
               dragon = self.world.new_actor(actors.HuntingDragon, pos)
               dragon.controller.set_waypoint(50)
 
@@ -2,3 +2,4 @@ from testbed import TestBed
 from mass import *
 from samples import *
 from tests import *
+from benchmarks import *
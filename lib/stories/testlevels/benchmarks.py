@@ -0,0 +1,82 @@
+from lib.stories import Story, storybook
+from lib import actors
+from mass import deploy_armies
+
+class Benchmark(Story):
+      """
+      Scripted scenario that runs for a fixed amount of game time
+      """
+      storybook_path = "benchmarks"
+      duration = 10.0
+      def __init__(self, *args):
+          Story.__init__(self, *args)
+          self.populate()
+
+      def populate(self):
+          """
+          Must be overloaded to create the actors
+          """
+          pass
+      def get_player(self):
+          return None
+      def update(self):
+          story_time, state_time = self.times()
+          if not self.game_over and story_time > self.duration:
+            self.set_state("finished")
+            self.set_result(True, exit_now = True)
+
+class MassBattle50(Benchmark):
+      pairs = 25
+      def populate(self):
+          spread = 8.0 * self.pairs
+          deploy_armies(self.world, actors.BehavingDragon, actors.BehavingVillager,
+                        self.pairs, 200.0, 200.0 + spread, spread)
+storybook.add(MassBattle50)
+
+class MassBattle500(MassBattle50):
+      pairs = 250
+      duration = 5.0
+storybook.add(MassBattle500)
+
+class MassBattle5000(MassBattle50):
+      pairs = 2500
+      duration = 1.0
+storybook.add(MassBattle5000)
+
+class BirdFlock(Benchmark):
+      birds = 500
+      predators = 5
+      def populate(self):
+          world = self.world
+          for i in xrange(self.birds):
+            bird = world.new_actor(actors.FlockingBird, world.random() * 1000 - 500)
+            bird.ypos = world.random() * bird.controller.ypos_upper_bound
+          for i in xrange(self.predators):
+            bird = world.new_actor(actors.PredatorBird, world.random() * 1000 - 500)
+            bird.ypos = world.random() * 10.0
+storybook.add(BirdFlock)
+
+class ParticleCaster(actors.Villager):
+      """ Holds magic balls in place, does not get hurt by them """
+      initial_hp     = 0
+      initial_energy = 30.0
+class ParticleField(Benchmark):
+      casters = 50
+      balls   = [actors.LifeBall, actors.WindBall, actors.TimeBall, actors.LifeBall]
+      def populate(self):
+          world = self.world
+          for i in xrange(self.casters):
+            caster = world.new_actor(ParticleCaster, i * 1000.0 / self.casters - 500)
+            for balltype in self.balls:
+              ball = caster.magic.new(balltype)
+              caster.magic.power(ball, (world.random() - 0.5) * 10.0)
+              caster.magic.move(ball, (world.random() - 0.5) * 4.0)
+storybook.add(ParticleField)
+
+class Skirmish(Benchmark):
+      def populate(self):
+          world = self.world
+          for i in xrange(2):
+            world.new_actor(actors.BehavingDragon, 75.0)
+            world.new_actor(actors.BehavingVillager, 100.0)
+storybook.add(Skirmish)
@@ -1,6 +1,18 @@
 from lib.stories import Story, storybook
 from lib import actors, effects
-from random import random
+
+def deploy_armies(world, dragon, villager, pairs, left = 200.0, right = 800.0, spread = 400.0):
+    """
+    Line up armies facing each other, each heading to the other's base
+
+    Dragons start up to spread in from left, villagers up to spread in
+    from right.
+    """
+    for i in xrange(pairs):
+      d = world.new_actor(dragon,   left  + world.random() * spread)
+      v = world.new_actor(villager, right - world.random() * spread)
+      d.controller.set_waypoint(right)
+      v.controller.set_waypoint(left)
 
 class MassBattle(Story):
       storybook_path = "demos"
@@ -9,11 +21,7 @@ class MassBattle(Story):
 
           self.default_scenery()
           world = self.world
-          for i in xrange(50):
-            d = world.new_actor(self.dragon,   200.0 + random() * 400.0)
-            v = world.new_actor(self.villager, 800.0 - random() * 400.0)
-            d.controller.set_waypoint(800.0)
-            v.controller.set_waypoint(200.0)
+          deploy_armies(world, self.dragon, self.villager, 50)
           world.camera.goto(400.0)
           
       def get_player(self):
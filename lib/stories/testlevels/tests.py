@@ -1,5 +1,6 @@
 from lib.stories import Story, storybook
 from lib import actors
+from mass import deploy_armies
 
 class TestBase(Story):
       storybook_path = "tests"
@@ -79,3 +80,50 @@ storybook.add(DualEvasion)
 class TripleEvasion(Evasion):
       enemies = 3
 storybook.add(TripleEvasion)
+
+def scan_actors(world, x1 = False, x2 = False, include = False, exclude = False):
+    """
+    World.get_actors without any index: every actor checked in turn
+    """
+    ret = []
+    for actor in world.all_actors():
+      if x1 and actor.pos < x1:
+        continue
+      if x2 and actor.pos > x2:
+        continue
+      if include and not [klass for klass in include if isinstance(actor, klass)]:
+        continue
+      if exclude and [klass for klass in exclude if isinstance(actor, klass)]:
+        continue
+      ret.append(actor)
+    return ret
+
+class ActorQueries(TestBase):
+      """
+      get_actors must give what a plain scan does, in the same order,
+      for small and large classes, ranged or not
+      """
+      max_time = 20.0
+      ranges   = [(False, False), (150.0, 250.0), (350.0, 450.0), (500.0, 800.0)]
+      includes = [False, [actors.MagicParticle], [actors.Dragon], [actors.Actor],
+                  [actors.Villager, actors.Dragon], [actors.Actor, actors.Dragon]]
+      excludes = [False, [actors.Dragon]]
+      def __init__(self, *args):
+          Story.__init__(self, *args)
+          deploy_armies(self.world, actors.BehavingDragon, actors.BehavingVillager, 10)
+
+      def update(self):
+          story_time, state_time = self.times()
+          if not self.game_over:
+            for x1, x2 in self.ranges:
+              for include in self.includes:
+                for exclude in self.excludes:
+                  found = self.world.get_actors(x1, x2, include = include, exclude = exclude)
+                  if found != scan_actors(self.world, x1, x2, include, exclude):
+                    self.set_state("differs")
+                    self.set_result(False, exit_now = True)
+                    return
+            if story_time > self.max_time:
+              self.set_state("same")
+              self.set_result(True, exit_now = True)
+storybook.add(ActorQueries)
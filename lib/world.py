@@ -1,11 +1,14 @@
-import pygame, time, math
+import pygame, time, math, inspect, heapq, itertools, random, collections, operator
 
-from lib import debug, actors
+from lib import debug, actors, fields, effects
 from lib.camera import Camera
 from lib.inputs import *
 from lib.fields import all as fieldtypes
 from lib.resources import Resources
 from lib.settings import settings
+from lib.spatial import PositionIndex
+from lib.parallax import Parallax
+from lib.perception import Perception
 
 import pygame
 from pygame.locals import *
@@ -15,7 +18,9 @@ class TimeKeeper:
       max_lag = 0.5
       stay_real_time = True
 
-      def __init__(self):
+      def __init__(self, simulate = False):
+          # jump from event to event without sleeping, see step_to()
+          self.simulate = simulate
           # game/real time are modified in steps by wait() function
           # this can be slowed down or sped up
           self.game_time = 0.0
@@ -25,9 +30,10 @@ class TimeKeeper:
           # last real time we wait()ed to
           self.last_real_time = time.time()
 
-          # upcoming schedule
+          # upcoming schedule, heaps of (time, seq, event)
           self.real_queue = []
           self.game_queue = []
+          self.seq = itertools.count()
 
           self.lag_rl = debug.RateLimit(1.0)
 
@@ -56,42 +62,91 @@ class TimeKeeper:
 
       # schedule management
       class Event:
-            def __init__(self, name, t, interval, game):
+            def __init__(self, name, t, interval, game, callback = None):
                 self.name = name
                 self.time = t
                 self.interval = interval
                 self.game = game
+                self.callback = callback
+                # matches the queue entry that is currently valid
+                self.seq = None
+                self.cancelled = False
             def __repr__(self):
-                return "%s %.3f/%.3f game=%s" % (self.name, self.time, self.interval, self.game)
+                return "%s %.3f/%.3f game=%s" % (self.name, self.time, self.interval or 0.0, self.game)
             def __str__(self):
                 return self.__repr__()
 
-      def schedule(self, name, interval = None, game = False):
-          if game:
+      def schedule(self, name, interval = None, game = False, callback = None, delay = None):
+          """
+          Schedule an event after delay (or interval) seconds, repeating
+          every interval seconds if given. Returns the event that can be
+          passed to cancel() and retime().
+          """
+          event = self.Event(name, None, interval, game, callback)
+          self.retime(event, delay)
+          return event
+      def retime(self, event, delay = None, interval = False):
+          """
+          Move the event to delay (or its interval) seconds from now,
+          optionally changing its interval
+          """
+          if interval is not False:
+            event.interval = interval
+          if delay is None:
+            delay = event.interval or 0
+          if event.game:
             queue = self.game_queue
-            t = self.get_game_time() + (interval or 0)
+            event.time = self.get_game_time() + delay
           else:
             queue = self.real_queue
             if self.stay_real_time:
               # events are scheduled from stepped real time (may be behind)
-              t = self.get_real_time() + (interval or 0)
+              event.time = self.get_real_time() + delay
             else:
               # events are scheduled from current clock
-              t = time.time() + (interval or 0)
-          queue.append(self.Event(name, t, interval, game))
-          queue.sort(lambda x, y: cmp(x.time, y.time))
+              event.time = time.time() + delay
+          # earlier entries of the event become stale, ties are kept in scheduling order
+          event.seq = self.seq.next()
+          event.cancelled = False
+          heapq.heappush(queue, (event.time, event.seq, event))
+      def cancel(self, event):
+          """
+          Stop the event from firing, its queue entry is dropped lazily
+          """
+          event.cancelled = True
 
       # scheduling itself
+      def peek(self, queue):
+          """
+          First valid event in the queue or None
+          """
+          while queue:
+            t, seq, event = queue[0]
+            if event.cancelled or event.seq != seq:
+              heapq.heappop(queue)
+            else:
+              return event
+          return None
       def get_next_event(self):
+          """
+          Take the next event off its queue, None if there is none (game
+          events do not come while paused, headless runs have no real
+          time events)
+          """
+          real_event = self.peek(self.real_queue)
           if self.paused():
-            return self.real_queue.pop(0)
+            game_event = None
           else:
-            real_event_time = self.real_queue[0].time
-            game_event_time = self.game_to_real(self.game_queue[0].time)
-            if real_event_time < game_event_time:
-              return self.real_queue.pop(0)
-            else:
-              return self.game_queue.pop(0)
+            game_event = self.peek(self.game_queue)
+          if real_event is None and game_event is None:
+            return None
+          if game_event is None or \
+             real_event is not None and real_event.time < self.game_to_real(game_event.time):
+            heapq.heappop(self.real_queue)
+            return real_event
+          else:
+            heapq.heappop(self.game_queue)
+            return game_event
       def event_time(self, event):
           if event.game:
             return self.game_to_real(event.time)
@@ -101,13 +156,39 @@ class TimeKeeper:
       def wait_for_event(self):
           """
           Sleep until the next scheduled event and return it's name
-          Reschedule the event
+          Reschedule the event and run its callback, if any
+          Returns None after idling if there is no event to wait for
           """
           e = self.get_next_event()
-          self.sleep_until(self.event_time(e))
+          if e is None:
+            # nothing can fire, let some real time pass instead of spinning
+            if self.simulate:
+              self.last_real_time += self.max_lag
+            else:
+              self.sleep_until(self.last_real_time + self.max_lag)
+            return None
+          if self.simulate:
+            self.step_to(e)
+          else:
+            self.sleep_until(self.event_time(e))
           if e.interval is not None:
-            self.schedule(e.name, e.interval, e.game)
+            self.retime(e)
+          else:
+            e.cancelled = True
+          if e.callback is not None:
+            e.callback()
           return e.name
+      def step_to(self, event):
+          """
+          Advance time straight to the event, game events land exactly on
+          their scheduled game time so the steps stay fixed
+          """
+          wakeup_time = self.event_time(event)
+          if event.game:
+            self.game_time = event.time
+          else:
+            self.game_time += (wakeup_time - self.last_real_time) * self.game_time_speed
+          self.last_real_time = wakeup_time
       def sleep_until(self, wakeup_time):
           """
           Sleep until specified time, updating game and real time as needed
@@ -134,15 +215,27 @@ class World:
       A container for all level objects (actors, fields)
       A time source
       """
-      def __init__(self, Story):
+      # order of values returned by field_values()
+      sampled_fields = [fields.TimeField, fields.WindField, fields.LifeField]
+
+      def __init__(self, Story, seed = None):
+          # all randomness in the world comes from here, for reproducible runs
+          if seed is None:
+            seed = settings.seed
+          self.seed = seed
+          self.rng  = random.Random(seed)
+          self.random = self.rng.random
+
           self.rsc = Resources()
           self.camera = Camera(self.rsc.graphics, (0, 100, 0, 50))
 
-          self._timekeeper = TimeKeeper()
-          self._timekeeper.schedule('draw', 1.0 / settings.target_fps)
-          self._timekeeper.schedule('input', 1.0 / 100.0)
+          self._timekeeper = TimeKeeper(simulate = settings.headless)
+          # headless simulation only needs the game updates
+          if not settings.headless:
+            self._timekeeper.schedule('draw', 1.0 / settings.target_fps)
+            self._timekeeper.schedule('input', 1.0 / 100.0)
+            self._timekeeper.schedule('update', 1.0 / 50.0)
           self._timekeeper.schedule('update_game', 1.0 / 50.0, game = True)
-          self._timekeeper.schedule('update', 1.0 / 50.0)
           self._timekeeper.set_game_speed(settings.game_speed)
 
           # world objects
@@ -150,10 +243,32 @@ class World:
           for fieldtype in fieldtypes:
             field = fieldtype()
             self.fields[fieldtype] = field
+          self.field_samples = {}
+          # shared by the controllers, built on first use each tick
+          self.perception = None
+          # (time due, actor) for scheduled controllers waiting for an update
+          self.control_queue  = collections.deque()
+          self.control_queued = set()
           self.actors = []
+          # numbers actors in the order they are added, see get_actors()
+          self.actor_seq = itertools.count()
+          self.actor_index = PositionIndex()
+          # actors by their class and each of its base classes
+          self.registry = {}
+          self.class_bases = {}
+          self.parallax = Parallax(self)
+          # number of actors at each distance, for culling
+          self.distances = {}
+          self.max_img_w = 0
+
+          # circles for the particle effects are made before the story starts
+          if not settings.headless:
+            effects.warm_up(self.rsc.graphics)
 
           # initiate story
           self.story = Story(self)
+          if not settings.headless:
+            self.parallax.prepare()
           self.run()
 
       def get_time(self): return self._timekeeper.get_game_time()
@@ -161,18 +276,27 @@ class World:
       def set_speed(self, val): self._timekeeper.set_game_speed(val)
       def get_speed(self): return self._timekeeper.get_game_speed()
 
+      # periodic callbacks for stories and controllers
+      def schedule(self, callback, interval = None, game = True, delay = None):
+          return self._timekeeper.schedule(None, interval, game, callback, delay)
+      def retime(self, event, delay = None, interval = False):
+          self._timekeeper.retime(event, delay, interval)
+      def cancel(self, event):
+          self._timekeeper.cancel(event)
+
       def run(self):
           story = self.story
           player = story.get_player()
           rsc = self.rsc
 
-          # debug objects
-          tm = debug.StatSet('World main loop timers')
+          # debug objects, timers are kept around for benchmarks
+          tm = self.timers = debug.StatSet('World main loop timers')
           tm.add(debug.Timer, 
-                 'update', 'update_actors', 'update_magic', 'update_fields',
+                 'update', 'update_actors', 'update_control', 'update_magic', 'update_fields',
                  'draw', 'draw_actors', 'draw_magic', 'draw_fields', 'events', 'calibrate')
-          ct = debug.StatSet('World main loop counters')
+          ct = self.counters = debug.StatSet('World main loop counters')
           ct.add(debug.RateCounter, 'fps', 'update', 'input')
+          ct.add(debug.AvgValue, 'control_latency')
           debug_rl = debug.RateLimit(1.0, exp = 0)
           dd = debug.DrawDebug()
           stats = ""
@@ -183,6 +307,7 @@ class World:
           else:
             c_char = None
           c_game = GameControl(self, player)
+          bases = self.class_bases
 
           while True:
             # exit condition
@@ -199,20 +324,31 @@ class World:
               tm.update.start()
               # actors moving
               tm.update_actors.start()
+              self.perception = None
               if not self._timekeeper.paused():
-                for actor in self.get_actors(exclude = [actors.MagicParticle]):
-                  actor.update()
+                self.sample_fields()
+                for actor in list(self.actors):
+                  if actors.MagicParticle not in bases[actor.__class__]:
+                    actor.update()
               tm.update_actors.end()
+
+              # planners that are due, as many as there is time for
+              tm.update_control.start()
+              if not self._timekeeper.paused():
+                self.run_controllers()
+              tm.update_control.end()
   
               # magic moving
               tm.update_magic.start()
               if not self._timekeeper.paused():
-                for actor in self.get_actors(include = [actors.MagicParticle]):
+                for actor in list(self.get_class(actors.MagicParticle)):
                   actor.update()
               tm.update_magic.end()
   
               # storyline evolving
               story.update()
+              # everything has moved, drawing relies on the order being exact
+              self.actor_index.repair()
   
               # update fields
               tm.update_fields.start()
@@ -229,25 +365,52 @@ class World:
             elif sch_event == "draw":
               ## draw
               tm.draw.start()
-              rsc.graphics.clear()
               # clear allocated debug message space
               dd.clear_allocations()
   
-              total_actor_count = total_magic_count = draw_actor_count = draw_magic_count = 0
+              draw_actor_count = draw_magic_count = 0
               # background changes slightly in color
               if self._timekeeper.paused():
                 day = -1.0
-                rsc.graphics.fill([16, 32, 96])
+                sky = (16, 32, 96)
               else:
                 day = math.sin(time.time()) + 1
-                rsc.graphics.fill([day * 32, 32 + day * 32, 128 + day * 32])
+                # with dirty rects each change repaints the whole screen
+                if settings.dirty_rects:
+                  day = round(day * 4) / 4.0
+                sky = (day * 32, 32 + day * 32, 128 + day * 32)
+  
+              # only actors on screen are drawn, in stacking order
+              # (the actor list itself stays in update order)
+              draw_list = []
+              magic_list = []
+              for actor in self.visible_actors():
+                if actors.MagicParticle in bases[actor.__class__]:
+                  magic_list.append(actor)
+                else:
+                  draw_list.append(actor)
+              culled_count = len(self.actors) - len(draw_list) - len(magic_list)
+              total_magic_count = len(self.get_class(actors.MagicParticle))
+              total_actor_count = len(self.actors) - total_magic_count
+              draw_list = self.parallax.merge(draw_list)
+              # sky and the scenery drawn before anything moving make up the static layer
+              static = 0
+              while static < len(draw_list) and draw_list[static].static:
+                static += 1
   
-              # draw actors
-              self.sort_actors()
+              # the static layer is drawn again when anything in it changes
+              static_key = (self.camera.offset_x, self.camera.mult_x, sky,
+                            tuple([id(actor) for actor in draw_list[:static]]),
+                            tuple([layer.version for layer in self.parallax.layers]))
   
               tm.draw_actors.start()
-              for actor in self.get_actors(exclude = [actors.MagicParticle]):
-                total_actor_count += 1
+              if rsc.graphics.begin_static(static_key):
+                rsc.graphics.fill(sky)
+                for actor in draw_list[:static]:
+                  if actor.draw():
+                    draw_actor_count += 1
+              rsc.graphics.end_static()
+              for actor in draw_list[static:]:
                 if actor.draw():
                   draw_actor_count += 1
                   if settings.debug and actor.debug_me:
@@ -256,8 +419,7 @@ class World:
   
               # magic particles
               tm.draw_magic.start()
-              for actor in self.get_actors(include = [actors.MagicParticle]):
-                total_magic_count += 1
+              for actor in magic_list:
                 if actor.draw():
                   draw_magic_count += 1
                   if settings.debug and actor.debug_me:
@@ -291,16 +453,18 @@ class World:
                             r += (float(part), float(part) / float(t) * 100.0)
                         return r
                     stats = "FPS: %.1f UPDATE: %.1f EVENT: %.1f\n" % (ct.fps, ct.update, ct.input)
+                    stats += effects.circle_stats() + "\n"
                     draw_left = tm.draw - tm.draw_actors - tm.draw_magic - tm.draw_fields
                     stats += "DRAW=%.3f" % (tm.draw)
                     stats += " (actors=%.3f/%u%% magic=%.3f/%u%% fields=%.3f/%u%% left=%.3f/%u%%)" % \
                              p(tm.draw, tm.draw_actors, tm.draw_magic, tm.draw_fields, draw_left)
-                    stats += " actors=%u/%u balls=%u/%u\n" % \
-                             (draw_actor_count, total_actor_count, draw_magic_count, total_magic_count)
-                    update_left = tm.update - tm.update_actors - tm.update_magic - tm.update_fields
+                    stats += " actors=%u/%u balls=%u/%u culled=%u\n" % \
+                             (draw_actor_count, total_actor_count, draw_magic_count, total_magic_count, culled_count)
+                    update_left = tm.update - tm.update_actors - tm.update_control - tm.update_magic - tm.update_fields
                     stats += "UPDATE=%.3f" % (tm.update)
-                    stats += " (actors=%.3f/%u%% magic=%.3f/%u%% fields=%.3f/%u%% left=%.3f/%u%%) calibrate=%.3f" % \
-                             (p(tm.update, tm.update_actors, tm.update_magic, tm.update_fields, update_left) + (tm.calibrate,))
+                    stats += " (actors=%.3f/%u%% control=%.3f/%u%% magic=%.3f/%u%% fields=%.3f/%u%% left=%.3f/%u%%) calibrate=%.3f" % \
+                             (p(tm.update, tm.update_actors, tm.update_control, tm.update_magic, tm.update_fields, update_left) + (tm.calibrate,))
+                    stats += "\nCONTROL: queued=%u latency=%.3fs" % (len(self.control_queue), ct.control_latency.value or 0.0)
                 dd.draw_stats(stats)
                 dd.draw_msg(debug.debugger.last_messages)
 
@@ -308,10 +472,9 @@ class World:
               if c_char is not None and c_char.get_magic:
                 i = 1
                 for ball in c_char.local_balls:
-                  ball_txt = rsc.fonts.textfont.render("%u: %s" % (i, ball.__class__.__name__), True, ball.field.color)
-                  ball_nr  = rsc.fonts.textfont.render("%u" % (i), True, ball.field.color)
-                  rsc.graphics.blit(ball_txt, (10, 40 + i * 20))
-                  rsc.graphics.blit(ball_nr, (self.camera.pl2sc_x(ball.pos), self.camera.sc_h() - 80))
+                  font = rsc.fonts.textfont
+                  rsc.graphics.text(font, "%u: %s" % (i, ball.__class__.__name__), (10, 40 + i * 20), ball.field.color)
+                  rsc.graphics.text(font, "%u" % (i), (self.camera.pl2sc_x(ball.pos), self.camera.sc_h() - 80), ball.field.color)
                   i += 1
 
               rsc.graphics.update()
@@ -333,18 +496,149 @@ class World:
       ## actor management
       def new_actor(self, actor_class, pos):
           actor = actor_class(self, pos)
+          # backgrounds and sky never change, they are drawn from cached layers
+          if actor.layered:
+            self.parallax.add(actor)
+            return actor
           self.actors.append(actor)
+          actor.insert_seq = self.actor_seq.next()
+          self.distances[actor.distance] = self.distances.get(actor.distance, 0) + 1
+          self.max_img_w = max(self.max_img_w, actor.img_w)
+          self.actor_index.add(actor)
+          for klass in self.get_bases(actor_class):
+            if not self.registry.has_key(klass):
+              self.registry[klass] = []
+            self.registry[klass].append(actor)
+          # controllers later in the tick should see it
+          if self.perception is not None:
+            self.perception.add(actor)
           return actor
       def del_actor(self, actor):
           self.actors.pop(self.actors.index(actor))
+          self.distances[actor.distance] -= 1
+          if not self.distances[actor.distance]:
+            del self.distances[actor.distance]
+          self.actor_index.remove(actor)
+          self.control_queued.discard(actor)
+          for klass in self.get_bases(actor.__class__):
+            bucket = self.registry[klass]
+            bucket.pop(bucket.index(actor))
+          if self.perception is not None:
+            self.perception.remove(actor)
+      def request_control(self, actor):
+          """
+          Queue the controller of actor for an update, it is done by
+          run_controllers() in order of requests
+          """
+          if actor not in self.control_queued:
+            self.control_queued.add(actor)
+            self.control_queue.append((actor.last_control + actor.controller.control_interval, actor))
+      def run_controllers(self):
+          """
+          Update queued controllers until the time budget for this tick is
+          spent, at least one gets its turn. The rest wait for the next tick,
+          so under load every planner is updated less often.
+          """
+          budget = settings.control_budget
+          if budget:
+            deadline = time.time() + budget / 1000.0
+          now = self.get_time()
+          queue = self.control_queue
+          while queue:
+            due, actor = queue.popleft()
+            # destroyed while waiting
+            if actor not in self.control_queued:
+              continue
+            self.control_queued.remove(actor)
+            actor.controller.latency = now - due
+            self.counters.control_latency.set(now - due)
+            actor.controller.update()
+            actor.last_control = now
+            if budget and time.time() > deadline:
+              break
+      def visible_actors(self):
+          """
+          Actors that would be drawn on screen, in drawing order, found from
+          the position index without calling into the actors
+          """
+          cam    = self.camera
+          sc_w   = cam.sc_w()
+          margin = self.max_img_w / 2
+          # render queue: the index keeps each distance in position order, so
+          # bucketing by stacking keeps that order without any sorting
+          buckets = {}
+          # actors further away move slower on screen
+          for distance in self.distances:
+            x1 = cam.sc2pl_x(-margin * distance)
+            x2 = cam.sc2pl_x((sc_w + margin) * distance)
+            for actor in self.actor_index.range(x1, x2):
+              if actor.distance != distance:
+                continue
+              x = cam.pl2sc_x(actor.pos) / distance
+              if x + actor.img_w / 2 < 0 or x - actor.img_w / 2 > sc_w:
+                continue
+              # further away first within the same stacking
+              key = (actor.stacking, -distance)
+              if key in buckets:
+                buckets[key].append(actor)
+              else:
+                buckets[key] = [actor]
+          visible = []
+          for key in sorted(buckets):
+            visible.extend(buckets[key])
+          return visible
+      def moved_actor(self, actor):
+          self.actor_index.moved(actor)
       def all_actors(self):
           return self.actors
+      def get_bases(self, actor_class):
+          """
+          The class itself and all its base classes
+          """
+          if not self.class_bases.has_key(actor_class):
+            self.class_bases[actor_class] = frozenset(inspect.getmro(actor_class))
+          return self.class_bases[actor_class]
+      def get_class(self, klass):
+          """
+          Registry bucket of actors that are instances of klass, do not modify
+          """
+          return self.registry.get(klass, [])
       def get_actors(self, x1 = False, x2 = False, filter = False, include = False, exclude = False):
           """
           Get actors with position in range [x1 : x2] and matching filter
+
+          Actors are returned in the order they were added to the world,
+          whichever way they are found.
           """
+          ranged = x1 or x2
+          # smallest set of actors to start with, and whether it is in order
+          ordered = True
+          if include:
+            candidates = []
+            for klass in include:
+              candidates += self.get_class(klass)
+            if len(include) > 1:
+              # overlapping classes
+              candidates = set(candidates)
+              ordered = False
+            if ranged and len(candidates) > len(self.actor_index) / 4:
+              candidates = self.actor_index.range(x1 or None, x2 or None)
+              ordered = False
+            else:
+              include = False
+          elif ranged:
+            candidates = self.actor_index.range(x1 or None, x2 or None)
+            ordered = False
+          else:
+            candidates = self.actors
+
+          if not (ranged or filter or include or exclude):
+            if not ordered:
+              return sorted(candidates, key = operator.attrgetter("insert_seq"))
+            return list(candidates)
           ret = []
-          for actor in self.actors:
+          bases = self.class_bases
+          for actor in candidates:
             if x1 and actor.pos < x1:
               continue
             if x2 and actor.pos > x2:
@@ -353,28 +647,54 @@ class World:
               continue
             if include:
               decision = False
+              klasses = bases[actor.__class__]
               for klass in include:
-                if isinstance(actor, klass):
+                if klass in klasses:
                   decision = True
                   break
               if not decision:
                 continue
             if exclude:
               decision = True
+              klasses = bases[actor.__class__]
               for klass in exclude:
-                if isinstance(actor, klass):
+                if klass in klasses:
                   decision = False
                   break
               if not decision:
                 continue
 
             ret.append(actor)
+          if not ordered:
+            ret.sort(key = operator.attrgetter("insert_seq"))
           return ret
-      def sort_actors(self):
-          self.actors.sort(lambda x, y: cmp(x.stacking, y.stacking) or cmp(x.pos, y.pos))
 
       # field management
       def get_field(self, fieldtype):
           return self.fields[fieldtype]
       def all_fields(self):
           return self.fields.values()
+      def sample_fields(self):
+          """
+          Sample every field at the positions of all actors feeling magic,
+          one batch per field instead of separate lookups for each actor
+          """
+          feelers   = [actor for actor in self.get_class(actors.Actor) if actor.feel_magic]
+          positions = [actor.pos for actor in feelers]
+          samples   = [self.fields[fieldtype].values(positions).tolist() for fieldtype in self.sampled_fields]
+          self.field_samples = dict(zip(feelers, zip(*samples)))
+      def perceive(self):
+          """
+          Snapshot of the actors for the controllers in this tick
+          """
+          if self.perception is None:
+            self.perception = Perception(self)
+          return self.perception
+      def field_values(self, actor):
+          """
+          Time, Wind and Life field values at the actor as sampled this tick
+          """
+          if self.field_samples.has_key(actor):
+            return self.field_samples[actor]
+          # created during this tick
+          return tuple([self.fields[fieldtype].value(actor.pos) for fieldtype in self.sampled_fields])